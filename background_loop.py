@@ -0,0 +1,47 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional
+
+from loguru import logger
+
+
+class BackgroundLoop:
+    """
+    One asyncio event loop running forever on a daemon thread.
+
+    Synchronous code such as Streamlit handlers submits coroutines here instead of calling `asyncio.run`, so
+    loop-bound state (async clients, their connection pool, price caches) survives across calls.
+    """
+
+    def __init__(self, name: str = 'background-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule `coro` on the loop and return a future the calling thread can wait on."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run `coro` on the loop and block for its result, cancelling it after `timeout` seconds."""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, shutdown: Optional[Coroutine] = None, timeout: float = 5):
+        """Run the optional `shutdown` coroutine, then stop the loop and wait for its thread."""
+        if shutdown is not None:
+            try:
+                self.run(shutdown, timeout)
+            except Exception as e:
+                logger.error(f"Background loop shutdown failed: {str(e)}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
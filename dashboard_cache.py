@@ -0,0 +1,102 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+
+@dataclass
+class CacheEntry:
+    data: dict
+    fingerprint: tuple
+    fetched_at: float
+
+
+def credential_fingerprint(cred) -> tuple:
+    return cred['api_key'], cred['api_secret'], str(cred['initial_value_usd']), cred['label']
+
+
+def failed_credential_data(cred, status: str, error: str) -> dict:
+    return {
+        'label': cred['label'],
+        'status': status,
+        'error': error,
+        'initial_value': float(cred['initial_value_usd'])
+    }
+
+
+class DashboardCache:
+    """
+    Dashboard rows per (user id, credential id), served stale while a background refresh brings them up to date.
+
+    Only credentials never fetched, or edited since, block the caller. A refresh that fails keeps the previous
+    row, marked stale, so one bad credential does not blank its row. `fetch` returns one row per credential and
+    must report a failure as a row whose status is not 'ok' (see `failed_credential_data`), never as zeros.
+    """
+
+    def __init__(self, fetch: Callable[[List[dict]], List[dict]], ttl: float,
+                 refresh_in_background: Callable[[Callable[[], None]], None] = None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self._refresh_in_background = refresh_in_background or (
+            lambda job: threading.Thread(target=job, daemon=True).start())
+        self._entries: Dict[Tuple[int, int], CacheEntry] = {}
+        self._refreshing: Set[Tuple[int, int]] = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, credentials: List[dict]) -> List[Tuple[dict, float]]:
+        """Rows for `credentials` in order, each with the time.time() it was fetched at."""
+        missing = [cred for cred in credentials if self._entry(user_id, cred) is None]
+        if missing:
+            self._store(user_id, missing, self._fetch(missing))
+        now = time.time()
+        with self._lock:
+            entries = [self._entries.get((user_id, cred['id'])) for cred in credentials]
+            # an entry dropped by a concurrent invalidate (e.g. another tab) is refetched in the background
+            stale = [cred for cred, entry in zip(credentials, entries)
+                     if (entry is None or now - entry.fetched_at > self.ttl)
+                     and (user_id, cred['id']) not in self._refreshing]
+            self._refreshing.update((user_id, cred['id']) for cred in stale)
+        if stale:
+            self._refresh_in_background(lambda: self._refresh(user_id, stale))
+        return [(entry.data, entry.fetched_at) if entry is not None
+                else (failed_credential_data(cred, 'pending', '正在刷新'), now)
+                for cred, entry in zip(credentials, entries)]
+
+    def invalidate(self, user_id: int):
+        """Forget the rows of `user_id` only, other users keep theirs."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def _entry(self, user_id: int, cred) -> Optional[CacheEntry]:
+        entry = self._entries.get((user_id, cred['id']))
+        if entry is None or entry.fingerprint != credential_fingerprint(cred):
+            return None
+        return entry
+
+    def _refresh(self, user_id: int, credentials: List[dict]):
+        try:
+            self._store(user_id, credentials, self._fetch(credentials))
+        except Exception as e:
+            logger.error(f"Background dashboard refresh failed for user {user_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update((user_id, cred['id']) for cred in credentials)
+
+    def _store(self, user_id: int, credentials: List[dict], rows: List[dict]):
+        now = time.time()
+        with self._lock:
+            for cred, row in zip(credentials, rows):
+                key = (user_id, cred['id'])
+                previous = self._entries.get(key)
+                # an edited credential's failure must not show the previous credential's numbers
+                if (row['status'] != 'ok' and previous is not None and 'total_value' in previous.data
+                        and previous.fingerprint == credential_fingerprint(cred)):
+                    # keep the last good numbers, flagged with why they are not fresh
+                    self._entries[key] = CacheEntry(
+                        data=previous.data | {'status': 'stale', 'error': row['error']},
+                        fingerprint=previous.fingerprint, fetched_at=previous.fetched_at)
+                else:
+                    self._entries[key] = CacheEntry(data=row, fingerprint=credential_fingerprint(cred), fetched_at=now)
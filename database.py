@@ -1,157 +1,292 @@
+import atexit
 import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import bcrypt
 import psycopg2
 from dotenv import load_dotenv
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+from gr_session import hash_token
 
 load_dotenv()
 
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))  # connections opened up front and kept open
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))  # connections open at most, callers beyond that wait
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))  # idle seconds after which a connection is pinged
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # cost of new hashes, older hashes are upgraded on login
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', 2))  # password hashes computed at the same time
+ST_SESSION_TTL = int(os.getenv('ST_SESSION_TTL', 30 * 60))  # seconds a session token stays valid, replaced on resume
+
+_bcrypt_executor = ThreadPoolExecutor(BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, os.getenv('DATABASE_URL'))
+    return _pool
+
+def _is_healthy(conn) -> bool:
+    if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    # idle for a while, the server or a proxy may have dropped it
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout(pool: ThreadedConnectionPool):
+    conn = pool.getconn()
+    while not _is_healthy(conn):
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
+@contextmanager
 def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
+    """
+    Check a connection out of the shared pool for the duration of the `with` block.
+
+    The transaction is committed when the block exits normally and rolled back when it raises. Connections found
+    broken are closed instead of returned to the pool.
+    """
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"no database connection free after {DB_POOL_TIMEOUT}s")
+    try:
+        pool = _get_pool()
+        conn = _checkout(pool)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            broken = conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN
+            if broken:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(broken))
+    finally:
+        _pool_slots.release()
+
+def close_db_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+atexit.register(close_db_pool)
 
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Create users table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            password_hash VARCHAR(255) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create credentials table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS binance_credentials (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            api_key VARCHAR(255) NOT NULL,
-            api_secret VARCHAR(255) NOT NULL,
-            initial_value_usd DECIMAL(20, 2) NOT NULL,
-            label VARCHAR(50) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, label)
-        )
-    ''')
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_db_connection() as conn, conn.cursor() as cur:
+        # Create users table
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Create credentials table
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS binance_credentials (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                api_key VARCHAR(255) NOT NULL,
+                api_secret VARCHAR(255) NOT NULL,
+                initial_value_usd DECIMAL(20, 2) NOT NULL,
+                label VARCHAR(50) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_id, label)
+            )
+        ''')
+
+        # Create login sessions table, tokens are stored hashed
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                token_hash CHAR(64) PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_user_sessions_user_id ON user_sessions (user_id)")
 
 def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
 
 def verify_password(password: str, password_hash: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
+def password_rounds(password_hash: str) -> int:
+    # $2b$<rounds>$<salt and hash>
+    return int(password_hash.split('$')[2])
+
+def run_bcrypt(fn, *args):
+    """
+    Run a bcrypt call on the bounded bcrypt pool and wait for it. A login burst queues there, at most
+    BCRYPT_WORKERS cores busy hashing, instead of every script thread hashing at once.
+    """
+    return _bcrypt_executor.submit(fn, *args).result()
+
 class UserManager:
     @staticmethod
     def create_user(username: str, password: str) -> bool:
+        # hashed before checkout, a connection is not held through bcrypt
+        password_hash = run_bcrypt(hash_password, password)
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            password_hash = hash_password(password)
-            cur.execute(
-                "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
-                (username, password_hash)
-            )
-            conn.commit()
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
+                    (username, password_hash)
+                )
             return True
         except psycopg2.Error:
             return False
-        finally:
-            cur.close()
-            conn.close()
     
     @staticmethod
     def verify_user(username: str, password: str) -> dict:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(
-            "SELECT * FROM users WHERE username = %s",
-            (username,)
-        )
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT * FROM users WHERE username = %s",
+                (username,)
+            )
+            user = cur.fetchone()
         
-        if user and verify_password(password, user['password_hash']):
-            return dict(user)
-        return None
+        if not user or not run_bcrypt(verify_password, password, user['password_hash']):
+            return None
+        if password_rounds(user['password_hash']) != BCRYPT_ROUNDS:
+            # the plain password is only known now, upgrade the hash to the configured cost
+            user['password_hash'] = run_bcrypt(hash_password, password)
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s",
+                    (user['password_hash'], user['id'])
+                )
+        return dict(user)
+
+class SessionManager:
+    @staticmethod
+    def create_session(user_id: int) -> str:
+        token = secrets.token_urlsafe(32)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM user_sessions WHERE expires_at < NOW()")
+            cur.execute(
+                """INSERT INTO user_sessions (token_hash, user_id, expires_at)
+                   VALUES (%s, %s, NOW() + %s * INTERVAL '1 second')""",
+                (hash_token(token), user_id, ST_SESSION_TTL)
+            )
+        return token
+    
+    @staticmethod
+    def rotate_session(token: str):
+        """Swap a valid `token` for a new one in one transaction, returns (user, new token) or None."""
+        new_token = secrets.token_urlsafe(32)
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """DELETE FROM user_sessions WHERE token_hash = %s AND expires_at > NOW()
+                   RETURNING user_id""",
+                (hash_token(token),)
+            )
+            session = cur.fetchone()
+            if session is None:
+                return None
+            cur.execute(
+                """INSERT INTO user_sessions (token_hash, user_id, expires_at)
+                   VALUES (%s, %s, NOW() + %s * INTERVAL '1 second')""",
+                (hash_token(new_token), session['user_id'], ST_SESSION_TTL)
+            )
+            cur.execute("SELECT * FROM users WHERE id = %s", (session['user_id'],))
+            user = cur.fetchone()
+        return (dict(user), new_token) if user else None
+    
+    @staticmethod
+    def revoke_session(token: str) -> bool:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM user_sessions WHERE token_hash = %s",
+                (hash_token(token),)
+            )
+            return cur.rowcount > 0
 
 class CredentialManager:
     @staticmethod
     def add_credential(user_id: int, api_key: str, api_secret: str, 
                       initial_value_usd: float, label: str) -> bool:
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                """INSERT INTO binance_credentials 
-                   (user_id, api_key, api_secret, initial_value_usd, label)
-                   VALUES (%s, %s, %s, %s, %s)""",
-                (user_id, api_key, api_secret, initial_value_usd, label)
-            )
-            conn.commit()
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO binance_credentials 
+                       (user_id, api_key, api_secret, initial_value_usd, label)
+                       VALUES (%s, %s, %s, %s, %s)""",
+                    (user_id, api_key, api_secret, initial_value_usd, label)
+                )
             return True
         except psycopg2.Error:
             return False
-        finally:
-            cur.close()
-            conn.close()
     
     @staticmethod
     def get_credentials(user_id: int) -> list:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(
-            "SELECT * FROM binance_credentials WHERE user_id = %s",
-            (user_id,)
-        )
-        credentials = cur.fetchall()
-        cur.close()
-        conn.close()
-        return credentials
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT * FROM binance_credentials WHERE user_id = %s",
+                (user_id,)
+            )
+            return cur.fetchall()
     
     @staticmethod
     def update_credential(cred_id: int, user_id: int, api_key: str, 
                          api_secret: str, initial_value_usd: float, label: str) -> bool:
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                """UPDATE binance_credentials 
-                   SET api_key = %s, api_secret = %s, 
-                       initial_value_usd = %s, label = %s
-                   WHERE id = %s AND user_id = %s""",
-                (api_key, api_secret, initial_value_usd, label, cred_id, user_id)
-            )
-            conn.commit()
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """UPDATE binance_credentials 
+                       SET api_key = %s, api_secret = %s, 
+                           initial_value_usd = %s, label = %s
+                       WHERE id = %s AND user_id = %s""",
+                    (api_key, api_secret, initial_value_usd, label, cred_id, user_id)
+                )
             return True
         except psycopg2.Error:
             return False
-        finally:
-            cur.close()
-            conn.close()
     
     @staticmethod
     def delete_credential(cred_id: int, user_id: int) -> bool:
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                "DELETE FROM binance_credentials WHERE id = %s AND user_id = %s",
-                (cred_id, user_id)
-            )
-            conn.commit()
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM binance_credentials WHERE id = %s AND user_id = %s",
+                    (cred_id, user_id)
+                )
             return True
         except psycopg2.Error:
             return False
-        finally:
-            cur.close()
-            conn.close()
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, Tuple
+from typing import Tuple
 
 import gradio as gr
 import pandas as pd
@@ -10,20 +10,23 @@ from gr_backend import delete_account as delete_account_backend
 from gr_backend import delete_strategy as delete_strategy_backend
 from gr_backend import delete_user as delete_user_backend
 from gr_backend import get_account as get_account_backend
+from gr_backend import get_account_history as get_account_history_backend
 from gr_backend import get_db
 from gr_backend import get_strategy as get_strategy_backend
-from gr_backend import get_tables as get_tables_backend
 from gr_backend import get_user as get_user_backend
 from gr_backend import get_user_linked_accounts
+from gr_backend import iter_tables as iter_tables_backend
 from gr_backend import list_accounts as list_accounts_backend
 from gr_backend import list_user_linked_accounts
 from gr_backend import list_users as list_users_backend
 from gr_backend import logout as user_logout_backend
+from gr_backend import start_balance_refresher
 from gr_backend import update_account
 from gr_backend import update_strategy as update_strategy_backend
 from gr_backend import update_user as update_user_backend
 from gr_backend import user_login as user_login_backend
 from gr_backend import validate_exchange_credentials
+from gr_migrations import run_migrations
 
 
 def null_check(*args):
@@ -177,11 +180,29 @@ def update_user(token, name, login_token, linked_accounts):
     return "用户更新失败."
 
 
-def get_tables(token, date_ranges: Dict[str, Tuple[str, str]] = None):
+def reload_history(token, account_name, start_date: float, end_date: float, history_ranges):
+    """Reload one account's history table for a new date range, leaving realtime balances untouched."""
     null_check(token)
+    start_date = datetime.fromtimestamp(start_date).strftime("%Y-%m-%d")
+    end_date = datetime.fromtimestamp(end_date).strftime("%Y-%m-%d")
     db = next(get_db())
+    try:
+        history_df = get_account_history_backend(token, account_name, start_date, end_date, db)
+    finally:
+        db.close()
+    return history_df, history_ranges | {account_name: (start_date, end_date)}
 
-    return get_tables_backend(token, date_ranges, db)
+
+def stream_tables(token, date_range_config):
+    """Yield the balance tables as they fill in, first from stored balances, then per account."""
+    if not token or not date_range_config:
+        yield {}
+        return
+    db = next(get_db())
+    try:
+        yield from iter_tables_backend(token, date_range_config['date_ranges'], db)
+    finally:
+        db.close()
 
 
 # ######### ui react ###########
@@ -225,9 +246,11 @@ def fill_linked_accounts(token, user_name):
     return gr.CheckboxGroup(choices=account_names, value=linked_accounts)
 
 
-def update_tables_via_date_range_cfg(cfg):
+def update_tables_via_date_range_cfg(cfg, history_ranges):
     if cfg:
         cfg['counter'] += 1
+        # keep the ranges picked with the per-account reload buttons
+        cfg['date_ranges'] |= history_ranges
         return cfg, f"实时余额更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     return cfg, "登录以查看余额!"
 
@@ -355,22 +378,21 @@ def admin_interface():
     return admin_ui
 
 
-def set_date_ranges(token, start_date: str = None, end_date: str = None, account_name: str = None):
+def set_date_ranges(token):
     db = next(get_db())
     accounts = list_user_linked_accounts(token, db)
-    default_ranges = {a.account_name: ('2025-01-01', '2025-02-01') for a in accounts}
-    if start_date and end_date and account_name:
-        default_ranges[account_name] = (start_date, end_date)
-    return default_ranges
+    return {a.account_name: ('2025-01-01', '2025-02-01') for a in accounts}
 
 
-def set_date_range_config(token, start_date: str = None, end_date: str = None, account_name: str = None):
-    return {'counter': 0, 'date_ranges': set_date_ranges(token, start_date, end_date, account_name)}
+def set_date_range_config(token):
+    return {'counter': 0, 'date_ranges': set_date_ranges(token)}
 
 
 def user_interface():
     session_token = gr.State("")  # Initialize empty session token
     date_range_cfg = gr.State({})
+    balance_tables = gr.State({})
+    history_ranges = gr.State({})  # account name -> date range picked with its reload button
     with gr.Blocks() as user_ui:
         with gr.Row():
             gr.Markdown("# 用户面板")
@@ -390,15 +412,14 @@ def user_interface():
                 latest_time_txt = gr.Textbox(lambda: f"最近更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
                                              container=False, every=60, show_label=False, interactive=False)
 
-        @gr.render([date_range_cfg, session_token])
-        def render_tables(date_range_config, token):
-            if token and date_range_config:
-                balance_tables = get_tables(token, date_range_config['date_ranges'])
-            else:
+        @gr.render([balance_tables])
+        def render_tables(balance_tables):
+            if not balance_tables:
                 balance_tables = {"summarized": pd.DataFrame(),
                                   "linked_accounts": [{
                                       'name': 'N/A',
                                       'start_date': '2025-01-01',
+                                      'pending': False,
                                       "data": pd.DataFrame(),
                                       "history": {'start_date': '2025-01-01',
                                                   'end_date': '2026-01-01',
@@ -414,8 +435,12 @@ def user_interface():
                     account_start_date = account['start_date']
                     history_df = account['history']['data']
                     start_date, end_date = account['history']['start_date'], account['history']['end_date']
-                    with gr.Accordion(label=f"< {account_name} > 自 {account_start_date} ", open=False):
-                        gr.DataFrame(value=account_df, show_label=False)
+                    pending_label = "(实时余额加载中...)" if account['pending'] else ""
+                    with gr.Accordion(label=f"< {account_name} > 自 {account_start_date} {pending_label}", open=False):
+                        if account['pending']:
+                            gr.Markdown("实时余额加载中...")
+                        else:
+                            gr.DataFrame(value=account_df, show_label=False)
                         gr.Markdown("### 账户余额历史")
                         with gr.Row():
                             start_date = gr.DateTime(
@@ -425,27 +450,27 @@ def user_interface():
                             with gr.Column():
                                 gr.Textbox('', interactive=False, show_label=False, container=False)
                                 reload_button = gr.Button("重新加载")
-                        gr.DataFrame(scale=4, value=history_df)
-
-                    def _set_date_range_config(s, sd, ed):
-                        sd = (datetime.fromtimestamp(sd)).strftime("%Y-%m-%d")
-                        ed = (datetime.fromtimestamp(ed)).strftime("%Y-%m-%d")
-                        return set_date_range_config(s, sd, ed, account_name)
+                        history_table = gr.DataFrame(scale=4, value=history_df)
 
                     reload_button.click(
-                        _set_date_range_config, inputs=[session_token, start_date, end_date], outputs=[date_range_cfg])
+                        reload_history,
+                        inputs=[session_token, gr.State(account_name), start_date, end_date, history_ranges],
+                        outputs=[history_table, history_ranges])
 
     login_action = login_button.click(fn=user_login, inputs=[login_token_input], outputs=[session_token, action_status])
     login_action.then(fn=set_date_range_config, inputs=[session_token], outputs=[date_range_cfg])
     logout_action = logout_button.click(fn=logout, inputs=[session_token], outputs=[session_token, action_status])
-    logout_action.then(fn=lambda: {}, outputs=[date_range_cfg])
-    latest_time_txt.change(update_tables_via_date_range_cfg, inputs=[date_range_cfg],
+    logout_action.then(fn=lambda: ({}, {}), outputs=[date_range_cfg, history_ranges])
+    date_range_cfg.change(stream_tables, inputs=[session_token, date_range_cfg], outputs=[balance_tables])
+    latest_time_txt.change(update_tables_via_date_range_cfg, inputs=[date_range_cfg, history_ranges],
                            outputs=[date_range_cfg, action_status])
 
     return user_ui
 
 
 if __name__ == "__main__":
+    run_migrations()
+    start_balance_refresher()
     with gr.Blocks() as app:
         gr.Markdown("# 资产跟踪器")
         with gr.Tab("用户"):
@@ -1,26 +1,43 @@
-import hashlib
+import asyncio
+import atexit
+import math
 import os
-import uuid
-from datetime import datetime
-from typing import Dict, List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import ccxt
+import pandas as pd
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 from loguru import logger
 from sqlalchemy.orm import Session
 
-from gr_db import (Account, AccountBalanceHistory, AccountBalances,
-                   SessionLocal, Strategy, StrategyBalance,
-                   StrategyBalanceRecord, User, UserAccountAssociation)
+from background_loop import BackgroundLoop
+from gr_db import (Account, AccountBalances, SessionLocal, Strategy,
+                   StrategyBalance, User, UserAccountAssociation)
+from gr_exchange import exchange_pool, sum_coin_to_usdt
+from gr_realtime import LIVE_VALUATION, BalanceEntry, BalanceStore, LiveValuator
+from gr_rollup import (INTRADAY_RESOLUTIONS, RAW_HISTORY_RETENTION_DAYS,
+                       downsample_history, pick_resolution, prune_raw_history,
+                       update_rollups)
+from gr_session import session_store
+from gr_snapshot import (SnapshotResult, StrategyCredentials,
+                         insert_balance_snapshots, snapshot_engine)
 
 load_dotenv()
-current_session_tokens = {}
-
-
-# Function to hash tokens
-def hash_token(token: str) -> str:
-    return hashlib.sha256(token.encode()).hexdigest()
+REALTIME_FETCH_WORKERS = int(os.getenv('REALTIME_FETCH_WORKERS', 16))  # concurrent exchange calls for iter_tables
+REALTIME_FETCH_TIMEOUT = float(os.getenv('REALTIME_FETCH_TIMEOUT', 10))  # seconds before falling back
+REALTIME_REFRESH_INTERVAL = int(os.getenv('REALTIME_REFRESH_INTERVAL', 60))  # seconds between background refreshes
+SNAPSHOT_INTERVAL_MINUTES = int(os.getenv('SNAPSHOT_INTERVAL_MINUTES', 0))  # 0 takes one snapshot per day
+HISTORY_AGGREGATION = os.getenv('HISTORY_AGGREGATION', 'last')  # last or mean per history bucket
+INTRADAY_TIME_FORMAT = '%Y-%m-%d %H:%M'
+_realtime_executor = ThreadPoolExecutor(max_workers=REALTIME_FETCH_WORKERS, thread_name_prefix='realtime-balance')
+balance_store = BalanceStore()
+live_valuator = LiveValuator(balance_store)
+# owns the pooled async clients and the live feeds, so both survive between refreshes and snapshots
+background_loop = BackgroundLoop(name='balance-refresh')
 
 
 # Admin login function
@@ -28,10 +45,8 @@ def admin_login(master_token: str) -> str:
     stored_master_token = os.getenv('MASTER_TOKEN')
     if master_token == stored_master_token:
         # Generate a unique session token
-        session_token = str(uuid.uuid4())
-        # Save authentication token to session state
-        current_session_tokens['admin'] = session_token
-        logger.info(f"Admin login successful! {current_session_tokens}")
+        session_token = session_store.issue('admin')
+        logger.info("Admin login successful!")
         return session_token
     logger.warning("Admin login failed: invalid master token")
     return ""
@@ -41,10 +56,8 @@ def user_login(login_token: str, db: Session) -> str:
     user = db.query(User).filter(User.login_token == login_token).first()
     if user:
         # Generate a unique session token
-        session_token = str(uuid.uuid4())
-        # Save authentication token to session state
-        current_session_tokens[user.id] = session_token
-        logger.info(f"User login successful for user: {user.name}, {current_session_tokens}")
+        session_token = session_store.issue(int(user.id))
+        logger.info(f"User login successful for user: {user.name}")
         return session_token
     logger.warning("User login failed: invalid login token")
     return ""
@@ -52,10 +65,7 @@ def user_login(login_token: str, db: Session) -> str:
 
 # # Logout function
 def logout(token: str):
-    if token in current_session_tokens.values():
-        # Remove authentication token from session state
-        key = [k for k, v in current_session_tokens.items() if v == token][0]
-        current_session_tokens.pop(key)
+    if session_store.revoke(token):
         logger.info("Logout successful")
         return True
     logger.warning("Logout failed: invalid session token")
@@ -73,90 +83,175 @@ def get_db():
 
 # User-Type Methods
 def get_user_id(session_token: str):
-    for user_id, token in current_session_tokens.items():
-        if token == session_token:
-            return user_id
-    raise Exception("Invalid session token")
+    user_id = session_store.resolve(session_token)
+    if user_id is None:
+        raise Exception("Invalid session token")
+    return user_id
 
 
 def retrieve_multi_info(user_id: str, db: Session):
-    linked_acc_ids = db.query(UserAccountAssociation).filter(UserAccountAssociation.user_id == user_id).all()
-    account_ids = [link.account_id for link in linked_acc_ids]
-    accounts = db.query(Account).filter(Account.id.in_(account_ids)).all()
-    account_names = [a.account_name for a in accounts]
-    strategies = db.query(Strategy).filter(Strategy.account_name.in_(account_names)).all()
+    accounts = db.query(Account).join(
+        UserAccountAssociation, UserAccountAssociation.account_id == Account.id
+    ).filter(UserAccountAssociation.user_id == user_id).all()
+    strategies = db.query(Strategy).filter(Strategy.account_id.in_([account.id for account in accounts])).all()
     return accounts, strategies
 
 
-def get_tables(token: str, date_ranges: Dict[str, Tuple[str, str]], db: Session) -> Dict:
+def iter_tables(token: str, date_ranges: Dict[str, Tuple[str, str]], db: Session,
+                timeout: float = REALTIME_FETCH_TIMEOUT) -> Iterator[Dict]:
     """
+    The balance tables of the user's accounts, yielded progressively:
+
      {"summarized_preset": pd.DataFrame(),
       "summarized_realtime": pd.DataFrame(),
       "linked_accounts": [{
           'name': 'account',
           'start_date': '2025-01-01',
+          'pending': False,
           "preset": pd.DataFrame(),
           "realtime": pd.DataFrame(),
           "history": {'start_date': '2025-01-01',
                       'end_date': '2026-01-01',
                       'data': pd.DataFrame()},
       }]}
+
+    The first yield comes before any exchange call, with balances from the balance store, and accounts still
+    missing some are marked pending with NaN in their place. The tables are yielded again each time a pending
+    account's balances are all in. The last yield is complete: strategies not back within `timeout` seconds get
+    their last known balance, or NaN if there is none.
     """
     logger.info(f"Getting balance tables")
     user_id = get_user_id(token)
     accounts, strategies = retrieve_multi_info(user_id, db)
-    account_ids = [account.id for account in accounts]
-    account_names = [str(account.account_name) for account in accounts]
     date_str_ranges = date_ranges
-    date_ranges = {account_name: (datetime.strptime(s, "%Y-%m-%d").date(),
-                                  datetime.strptime(e, "%Y-%m-%d").date())
-                   for account_name, (s, e) in date_str_ranges.items()}
-    strategy_id_name = {s.id: s.strategy_name for s in strategies}
-    account_balance_history = [db.query(AccountBalanceHistory).filter(
-        AccountBalanceHistory.timestamp >= date_ranges[account_name][0],
-        AccountBalanceHistory.timestamp <= date_ranges[account_name][1],
-        AccountBalanceHistory.account_id == account_id
-    ).all() for account_id, account_name in zip(account_ids, account_names)]
-
-    account_balances = [AccountBalances(
+    date_ranges = {int(account.id): tuple(datetime.strptime(d, "%Y-%m-%d").date()
+                                          for d in date_str_ranges[str(account.account_name)])
+                   for account in accounts}
+    resolutions = {account_id: pick_resolution(*date_range, intraday=SNAPSHOT_INTERVAL_MINUTES > 0)
+                   for account_id, date_range in date_ranges.items()}
+    strategy_id_name = {s.id: str(s.strategy_name) for s in strategies}
+    account_balance_history = query_balance_history(date_ranges, resolutions, strategy_id_name, db)
+    realtime_balances = balance_store.values([strategy.id for strategy in strategies])
+    missing = [strategy for strategy in strategies if strategy.id not in realtime_balances]
+    waiting = {int(account.id): {strategy.id for strategy in missing if strategy.account_id == account.id}
+               for account in accounts}
+    built: Dict[Tuple[int, bool], AccountBalances] = {}
+
+    def account_balances(account: Account, pending: bool) -> AccountBalances:
+        key = (int(account.id), pending)
+        if key not in built:
+            built[key] = AccountBalances(
+                name=str(account.account_name),
+                start_date=str(account.start_date),
+                preset_balances=[
+                    StrategyBalance(
+                        name=str(strategy.strategy_name),
+                        balance=float(strategy.preset_balance),
+                    ) for strategy in strategies if strategy.account_id == account.id],
+                realtime_balances=[
+                    StrategyBalance(
+                        name=str(strategy.strategy_name),
+                        balance=realtime_balances.get(strategy.id, float('nan')),
+                        status=balance_status(balance_store.get(int(strategy.id))),
+                    ) for strategy in strategies if strategy.account_id == account.id],
+                strategy_balance_records=account_balance_history[int(account.id)],
+                record_start_date=date_str_ranges[str(account.account_name)][0],
+                record_end_date=date_str_ranges[str(account.account_name)][1],
+                record_time_format=(INTRADAY_TIME_FORMAT if resolutions[int(account.id)] in INTRADAY_RESOLUTIONS
+                                    else '%Y-%m-%d')
+            )
+        return built[key]
+
+    def tables() -> Dict:
+        balances = [(account_balances(account, bool(waiting[int(account.id)])), bool(waiting[int(account.id)]))
+                    for account in accounts]
+        return {"summarized": AccountBalances.sum_df([balance for balance, _ in balances]),
+                "linked_accounts": [{
+                    "name": str(balance.name),
+                    "start_date": str(balance.start_date),
+                    "pending": pending,
+                    "data": balance.account_df,
+                    "history": {
+                        "start_date": balance.record_start_date,
+                        "end_date": balance.record_end_date,
+                        "data": balance.record_df,
+                    }
+                } for balance, pending in balances]}
+
+    futures = {future: strategy_id for strategy_id, future in submit_realtime_fetches(missing).items()}
+    yield tables()
+    if not futures:
+        return
+    account_of = {strategy.id: int(strategy.account_id) for strategy in missing}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            strategy_id = futures[future]
+            realtime_balances[strategy_id] = realtime_result(strategy_id, future)
+            waiting[account_of[strategy_id]].discard(strategy_id)
+            if not waiting[account_of[strategy_id]]:
+                yield tables()
+    except FuturesTimeoutError:
+        pending = [strategy_id for future, strategy_id in futures.items() if not future.done()]
+        logger.warning(f"{len(pending)} of {len(futures)} strategy balances missed the {timeout}s deadline")
+        for future, strategy_id in futures.items():
+            realtime_balances[strategy_id] = realtime_result(strategy_id, future)
+        for strategy_ids in waiting.values():
+            strategy_ids.clear()
+        yield tables()
+
+
+def get_account_history(token: str, account_name: str, start_date: str, end_date: str, db: Session) -> pd.DataFrame:
+    """
+    History table of one of the user's accounts between `start_date` and `end_date` (YYYY-MM-DD), read from the
+    database only, no exchange is called.
+    """
+    user_id = get_user_id(token)
+    account = db.query(Account).join(
+        UserAccountAssociation, UserAccountAssociation.account_id == Account.id
+    ).filter(UserAccountAssociation.user_id == user_id, Account.account_name == account_name).first()
+    if not account:
+        raise Exception("Account not found")
+    strategies = db.query(Strategy).filter(Strategy.account_id == account.id).all()
+    date_range = (datetime.strptime(start_date, "%Y-%m-%d").date(), datetime.strptime(end_date, "%Y-%m-%d").date())
+    resolution = pick_resolution(*date_range, intraday=SNAPSHOT_INTERVAL_MINUTES > 0)
+    history = query_balance_history({int(account.id): date_range}, {int(account.id): resolution},
+                                    {s.id: str(s.strategy_name) for s in strategies}, db)
+    return AccountBalances(
         name=str(account.account_name),
         start_date=str(account.start_date),
         preset_balances=[
             StrategyBalance(
                 name=str(strategy.strategy_name),
                 balance=float(strategy.preset_balance),
-            ) for strategy in strategies if strategy.account_name == account.account_name],
-        realtime_balances=[
-            StrategyBalance(
-                name=str(strategy.strategy_name),
-                balance=retrieve_strategy_balance(strategy),
-            ) for strategy in strategies if strategy.account_name == account.account_name],
-        strategy_balance_records=[
-            StrategyBalanceRecord(
-                name=str(strategy_id_name[record.strategy_id]),
-                balance=float(record.balance),
-                timestamp=record.timestamp
-            ) for record in account_histories
-        ],
-        record_start_date=date_str_ranges[str(account.account_name)][0],
-        record_end_date=date_str_ranges[str(account.account_name)][1]
-    ) for account, account_histories in zip(accounts, account_balance_history)]
-
-    return {"summarized": AccountBalances.sum_df(account_balances),
-            "linked_accounts": [{
-                "name": str(account.name),
-                "start_date": str(account.start_date),
-                "data": account.account_df,
-                "history": {
-                    "start_date": account.record_start_date,
-                    "end_date": account.record_end_date,
-                    "data": account.record_df,
-                }
-            } for account in account_balances]}
+            ) for strategy in strategies],
+        realtime_balances=[],
+        strategy_balance_records=history[int(account.id)],
+        record_start_date=start_date,
+        record_end_date=end_date,
+        record_time_format=INTRADAY_TIME_FORMAT if resolution in INTRADAY_RESOLUTIONS else '%Y-%m-%d'
+    ).record_df
+
+
+def query_balance_history(date_ranges: Dict[int, Tuple[date, date]], resolutions: Dict[int, str],
+                          strategy_id_name: Dict[int, str], db: Session) -> Dict[int, List[Tuple[str, float, date]]]:
+    """
+    History of several accounts, each filtered by its own (start, end) date range and downsampled by the database
+    to its resolution with the HISTORY_AGGREGATION of every bucket.
+
+    Returns (strategy name, balance, bucket start) tuples per account id; rows of unknown strategies are dropped.
+    """
+    history = {account_id: [] for account_id in date_ranges}
+    if not date_ranges:
+        return history
+    for account_id, strategy_id, timestamp, value in downsample_history(db, date_ranges, resolutions,
+                                                                        HISTORY_AGGREGATION):
+        if strategy_id in strategy_id_name and value is not None:
+            history[account_id].append((strategy_id_name[strategy_id], float(value), timestamp))
+    return history
 
 
 def check_admin_token(token: str):
-    if current_session_tokens.get('admin') != token:
+    if session_store.resolve(token) != 'admin':
         raise Exception("Unauthorized access")
 
 
@@ -177,14 +272,15 @@ def delete_account(token: str, account_name: str, db: Session):
     check_admin_token(token)
     account = db.query(Account).filter(Account.account_name == account_name).first()
     if account:
-        db.delete(account)
         user_account_links = db.query(UserAccountAssociation).filter(
             UserAccountAssociation.account_id == account.id).all()
         for link in user_account_links:
             db.delete(link)
-        strategies = db.query(Strategy).filter(Strategy.account_name == account_name).all()
+        strategies = db.query(Strategy).filter(Strategy.account_id == account.id).all()
         for strategy in strategies:
             db.delete(strategy)
+        db.flush()  # strategies reference the account, remove them first
+        db.delete(account)
         db.commit()
         logger.info(f"Deleted account {account_name} and its strategies and associations")
         return True
@@ -225,7 +321,11 @@ def list_user_linked_accounts(token: str, db: Session):
 def create_strategy(token: str, account_name: str, strategy_name: str, api_key: str, secret_key: str, passphrase: str,
                     exchange_type: str, preset_balance: float, db: Session):
     check_admin_token(token)
+    account = db.query(Account).filter(Account.account_name == account_name).first()
+    if not account:
+        raise Exception(f"Account {account_name} not found")
     new_strategy = Strategy(
+        account_id=int(account.id),
         account_name=account_name,
         strategy_name=strategy_name,
         api_key=api_key,
@@ -243,8 +343,8 @@ def create_strategy(token: str, account_name: str, strategy_name: str, api_key:
 
 def get_strategy(token: str, account_name, strategy_name: str, db: Session):
     check_admin_token(token)
-    strategy = db.query(Strategy).filter(Strategy.account_name == account_name,
-                                         Strategy.strategy_name == strategy_name).first()
+    strategy = db.query(Strategy).join(Account, Strategy.account_id == Account.id).filter(
+        Account.account_name == account_name, Strategy.strategy_name == strategy_name).first()
     return strategy
 
 
@@ -254,6 +354,7 @@ def delete_strategy(token: str, account_name: str, strategy_name: str, db: Sessi
     if strategy:
         db.delete(strategy)
         db.commit()
+        balance_store.discard(int(strategy.id))
         logger.info(f"Deleted strategy {strategy_name}")
         return True
     logger.warning(f"Strategy {strategy_name} not found, deletion failed")
@@ -271,6 +372,7 @@ def update_strategy(token: str, account_name: str, strategy_name: str, api_key:
         strategy.exchange_type = exchange_type
         strategy.preset_balance = preset_balance
         db.commit()
+        balance_store.discard(int(strategy.id))
         return strategy
     return None
 
@@ -388,107 +490,148 @@ def set_user_linked_account(token: str, user_name: str, account_ids: List[int],
 
 
 # Backend Utility Methods
-def _get_usdt_value_via_cross(currency, amount, exchange, markets):
-    btc_pair = f"{currency}/BTC"
-    btc_usdt_pair = "BTC/USDT"
-    if btc_pair in markets and btc_usdt_pair in markets:
-        ticker_currency_btc = exchange.fetch_ticker(btc_pair)
-        ticker_btc_usdt = exchange.fetch_ticker(btc_usdt_pair)
-        price_currency_btc = ticker_currency_btc['last']
-        price_btc_usdt = ticker_btc_usdt['last']
-        usdt_value = amount * price_currency_btc * price_btc_usdt
-        return usdt_value
-    eth_pair = f"{currency}/ETH"
-    eth_usdt_pair = "ETH/USDT"
-    if eth_pair in markets and eth_usdt_pair in markets:
-        ticker_currency_eth = exchange.fetch_ticker(eth_pair)
-        ticker_eth_usdt = exchange.fetch_ticker(eth_usdt_pair)
-        price_currency_eth = ticker_currency_eth['last']
-        price_eth_usdt = ticker_eth_usdt['last']
-        usdt_value = amount * price_currency_eth * price_eth_usdt
-        return usdt_value
-    return None
-
-
-def _sum_coin_to_usdt(exchange: ccxt.Exchange) -> float:
-    markets = exchange.load_markets()
-    balance = exchange.fetch_balance()
-    non_zero_balances = {
-        currency: amounts
-        for currency, amounts in balance['total'].items()
-        if amounts > 0
-    }
-    total_usdt_value = 0.0
-    prices = {}
-    for currency in non_zero_balances:
-        amount = balance['total'][currency]
-        if currency == 'USDT':
-            usdt_value = amount
-        else:
-            symbol = f"{currency}/USDT"
-            if symbol in markets:
-                ticker = exchange.fetch_ticker(symbol)
-                last_price = ticker['last']
-                usdt_value = amount * last_price
-            else:
-                logger.info("Market pair {symbol} not available. Trying alternative methods for {currency}...")
-                usdt_value = _get_usdt_value_via_cross(currency, amount, exchange, markets)
-                if usdt_value is None:
-                    logger.warning(f"Unable to value {currency} in USDT.")
-                    continue
-        prices[currency] = usdt_value
-        total_usdt_value += usdt_value
-    logger.info(f"Total Balance in USDT: {total_usdt_value:.2f}")
-    return total_usdt_value
-
-
 def retrieve_strategy_balance(strategy: Strategy) -> float:
     try:
-        exchange_class = getattr(ccxt, strategy.exchange_type.lower())
-        exchange = exchange_class({
-            'apiKey': strategy.api_key,
-            'secret': strategy.secret_key,
-            'password': strategy.passphrase
-        })
-        balance = _sum_coin_to_usdt(exchange)
+        exchange = exchange_pool.get(strategy.exchange_type, strategy.api_key, strategy.secret_key,
+                                     strategy.passphrase)
+        balance = sum_coin_to_usdt(exchange)
     except Exception as e:
         logger.error(f"Failed to retrieve balance for {strategy.strategy_name}: {str(e)}")
         return float('nan')
     return balance
 
 
+def balance_status(entry: Optional[BalanceEntry]) -> str:
+    """When the stored balance was fetched, and the error of the last refresh if that one failed."""
+    if entry is None:
+        return ''
+    fetched = entry.fetched_at.strftime('%Y-%m-%d %H:%M:%S') if entry.fetched_at else '从未成功'
+    return fetched if entry.error is None else f"{fetched} (刷新失败: {entry.error})"
+
+
+def submit_realtime_fetches(strategies: List[Strategy]) -> Dict[int, Future]:
+    """Start fetching the balances of `strategies`; results also land in the balance store when they arrive."""
+    def remember(strategy_id: int, future: Future):
+        if not future.cancelled() and future.exception() is None and not math.isnan(future.result()):
+            balance_store.set_value(strategy_id, future.result())
+
+    futures = {}
+    for strategy in strategies:
+        future = _realtime_executor.submit(retrieve_strategy_balance, strategy)
+        future.add_done_callback(lambda f, strategy_id=int(strategy.id): remember(strategy_id, f))
+        futures[strategy.id] = future
+    return futures
+
+
+def realtime_result(strategy_id: int, future: Future) -> float:
+    """The fetched balance, or the last known one (NaN if none) when the fetch failed or is not done."""
+    if future.done() and not future.cancelled() and future.exception() is None and not math.isnan(future.result()):
+        return future.result()
+    return balance_store.values([strategy_id]).get(strategy_id, float('nan'))
+
+
 def get_user_linked_accounts(user_name: str, db: Session):
-    user = db.query(User).filter(User.name == user_name).first()
-    linked_accounts = db.query(UserAccountAssociation).filter(UserAccountAssociation.user_id == user.id).all()
-    account_ids = [link.account_id for link in linked_accounts]
-    accounts = db.query(Account).filter(Account.id.in_(account_ids)).all()
+    accounts = db.query(Account).join(
+        UserAccountAssociation, UserAccountAssociation.account_id == Account.id
+    ).join(User, User.id == UserAccountAssociation.user_id).filter(User.name == user_name).all()
     return accounts
 
 
 # Scheduled Tasks with APScheduler
 
-def daily_balance_snapshot(db: Session):
+def snapshot_timestamp(now: datetime, interval_minutes: int = SNAPSHOT_INTERVAL_MINUTES) -> datetime:
+    """Start of the snapshot slot holding `now`: the day in daily mode, otherwise the `interval_minutes` slot."""
+    if interval_minutes <= 0:
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    minutes = (now.hour * 60 + now.minute) // interval_minutes * interval_minutes
+    return now.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+
+def balance_snapshot(db: Session, interval_minutes: int = SNAPSHOT_INTERVAL_MINUTES) -> SnapshotResult:
     accounts = db.query(Account).all()
-    for account in accounts:
-        strategies = db.query(Strategy).filter(Strategy.account_name == account.account_name).all()
-        for strategy in strategies:
-            strategy_balance = retrieve_strategy_balance(strategy)
-            new_record = AccountBalanceHistory(
-                account_id=int(account.id),
-                strategy_id=int(strategy.id),
-                balance=strategy_balance,
-                timestamp=datetime.now()
-            )
-            db.add(new_record)
-        logger.info(f"Daily balance snapshot taken for account {account.account_name}")
-    db.commit()
+    strategies = db.query(Strategy).filter(Strategy.account_id.in_([account.id for account in accounts])).all()
+    result = background_loop.run(snapshot_engine.fetch_balances(strategies))
+    timestamp = snapshot_timestamp(datetime.now(), interval_minutes)
+    try:
+        # one snapshot per strategy and slot, a re-run replaces the earlier one
+        insert_balance_snapshots(db, [{
+            'account_id': int(strategy.account_id),
+            'strategy_id': int(strategy.id),
+            'balance': result.balances[strategy.id],
+            'timestamp': timestamp
+        } for strategy in strategies if strategy.id in result.balances], upsert=True)
+        update_rollups(db, [(int(strategy.account_id), int(strategy.id), timestamp)
+                            for strategy in strategies if strategy.id in result.balances])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    failed = [str(strategy.strategy_name) for strategy in strategies if strategy.id in result.failures]
+    logger.info(f"Balance snapshot {timestamp} taken for {len(result.balances)} strategies across "
+                f"{len(accounts)} accounts in {result.elapsed:.1f}s")
+    if failed:
+        logger.warning(f"Balance snapshot {timestamp} missed {len(failed)} strategies: {failed}")
+    return result
+
+
+def refresh_realtime_balances(db: Session):
+    strategies = db.query(Strategy).all()
+    if LIVE_VALUATION:
+        # streamed strategies keep their own values current, only the rest are polled
+        try:
+            background_loop.run(live_valuator.sync([StrategyCredentials.from_strategy(strategy)
+                                                    for strategy in strategies]), REALTIME_FETCH_TIMEOUT)
+            strategies = [strategy for strategy in strategies if not live_valuator.is_live(int(strategy.id))]
+        except Exception as e:
+            logger.error(f"Failed to sync live valuation, polling every strategy: {str(e)}")
+    result = background_loop.run(snapshot_engine.fetch_balances(strategies))
+    fetched_at = datetime.now()
+    for strategy_id, balance in result.balances.items():
+        balance_store.set_value(strategy_id, balance, fetched_at)
+    for strategy_id, error in result.failures.items():
+        balance_store.set_error(strategy_id, error)
+
+
+async def shutdown_background_work():
+    await asyncio.gather(snapshot_engine.close(), live_valuator.close(), return_exceptions=True)
+
+
+atexit.register(lambda: background_loop.stop(shutdown_background_work()))
+atexit.register(exchange_pool.close)
+
+
+def start_balance_refresher(interval: int = REALTIME_REFRESH_INTERVAL):
+    def refresh():
+        db = next(get_db())
+        try:
+            refresh_realtime_balances(db)
+        finally:
+            db.close()
+        # the pool only evicts when a client is requested, idle sessions would otherwise stay open between page loads
+        exchange_pool.evict_idle()
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(refresh, 'interval', seconds=interval, next_run_time=datetime.now(),
+                      max_instances=1, coalesce=True)
+    scheduler.start()
+    logger.info(f"Realtime balance refresher started, every {interval}s")
+    return scheduler
 
 
-def start_scheduler(hour=0, minute=0):
+def start_scheduler(hour=0, minute=0, interval_minutes=SNAPSHOT_INTERVAL_MINUTES):
     scheduler = BackgroundScheduler()
-    scheduler.add_job(lambda: daily_balance_snapshot(next(get_db())), 'cron', hour=hour, minute=minute)
+    if interval_minutes > 0:
+        scheduler.add_job(lambda: balance_snapshot(next(get_db()), interval_minutes), 'interval',
+                          minutes=interval_minutes, max_instances=1, coalesce=True)
+    else:
+        scheduler.add_job(lambda: balance_snapshot(next(get_db()), interval_minutes), 'cron', hour=hour, minute=minute)
+    if RAW_HISTORY_RETENTION_DAYS > 0:
+        scheduler.add_job(lambda: prune_raw_history(next(get_db())), 'cron', hour=(hour + 1) % 24, minute=minute)
     scheduler.start()
-    logger.info(f"Scheduler started for every day at {hour}:{minute}")
+    if interval_minutes > 0:
+        logger.info(f"Scheduler started for every {interval_minutes} minutes")
+    else:
+        logger.info(f"Scheduler started for every day at {hour}:{minute}")
 
 # Uncomment the line below to start the scheduler when running this module
 # start_scheduler()
@@ -2,10 +2,12 @@ import os
 from datetime import datetime
 from typing import List
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from sqlalchemy import Column, Date, Float, Integer, String, create_engine
+from sqlalchemy import (Column, Date, DateTime, Float, ForeignKey, Index,
+                        Integer, String, create_engine)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -35,6 +37,7 @@ class Strategy(Base):
     __tablename__ = APP_PREFIX + 'strategies'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey(Account.id), nullable=False)
     account_name = Column(String)
     strategy_name = Column(String)
     api_key = Column(String)
@@ -43,6 +46,10 @@ class Strategy(Base):
     exchange_type = Column(String)
     preset_balance = Column(Float)
 
+    __table_args__ = (
+        Index('ix_gr_strategies_account_id_strategy_name', 'account_id', 'strategy_name', unique=True),
+    )
+
 
 # Users Table
 class User(Base):
@@ -60,6 +67,24 @@ class UserAccountAssociation(Base):
     user_id = Column(Integer)
     account_id = Column(Integer)
 
+    __table_args__ = (
+        Index('ix_gr_user_accounts_association_user_id_account_id', 'user_id', 'account_id', unique=True),
+    )
+
+
+# Session_Tokens Table: login sessions shared by every app worker
+class SessionToken(Base):
+    __tablename__ = APP_PREFIX + 'session_tokens'
+
+    token_hash = Column(String, primary_key=True)
+    user_id = Column(String)
+    expires_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_gr_session_tokens_user_id', 'user_id'),
+        Index('ix_gr_session_tokens_expires_at', 'expires_at'),
+    )
+
 
 # Account_Balance_History Table
 class AccountBalanceHistory(Base):
@@ -69,16 +94,43 @@ class AccountBalanceHistory(Base):
     account_id = Column(Integer)
     strategy_id = Column(Integer)
     balance = Column(Float)
-    timestamp = Column(Date)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_gr_account_balance_history_account_id_timestamp', 'account_id', 'timestamp'),
+        Index('ix_gr_account_balance_history_strategy_id_timestamp', 'strategy_id', 'timestamp', unique=True),
+    )
+
+
+# Strategy_Balance_Rollup Table: per strategy OHLC of the balance per day, week or month
+class StrategyBalanceRollup(Base):
+    __tablename__ = APP_PREFIX + 'strategy_balance_rollup'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String)
+    bucket_start = Column(Date)
+    account_id = Column(Integer)
+    strategy_id = Column(Integer)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    total = Column(Float)
+    samples = Column(Integer)
+    last_timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_gr_strategy_balance_rollup_granularity_strategy_id_bucket_start',
+              'granularity', 'strategy_id', 'bucket_start', unique=True),
+        Index('ix_gr_strategy_balance_rollup_granularity_account_id_bucket_start',
+              'granularity', 'account_id', 'bucket_start'),
+    )
 
 
 class StrategyBalance(BaseModel):
     name: str
     balance: float
-
-
-class StrategyBalanceRecord(StrategyBalance):
-    timestamp: datetime
+    status: str = ''  # when a realtime balance was fetched, and why its last refresh failed if it did
 
 
 class AccountBalances(BaseModel):
@@ -86,62 +138,62 @@ class AccountBalances(BaseModel):
     start_date: str
     preset_balances: List[StrategyBalance]
     realtime_balances: List[StrategyBalance]
-    strategy_balance_records: List[StrategyBalanceRecord]
+    strategy_balance_records: List[tuple]  # (strategy name, balance, timestamp)
     record_start_date: str
     record_end_date: str
+    record_time_format: str = '%Y-%m-%d'
 
     @property
     def account_df(self) -> pd.DataFrame:
-        account_df = pd.DataFrame(
-            data=[(preset_balance.name, preset_balance.balance, round(realtime_balance.balance, ROUND_DIGITS))
-                  for preset_balance, realtime_balance in zip(self.preset_balances, self.realtime_balances)],
-            columns=["策略名称", "预设余额 $", "实时余额 $"]
-        )
+        presets = np.array([balance.balance for balance in self.preset_balances], dtype=float)
+        realtimes = np.array([balance.balance for balance in self.realtime_balances], dtype=float)
+        account_df = pd.DataFrame({
+            "策略名称": [balance.name for balance in self.preset_balances],
+            "预设余额 $": presets,
+            "实时余额 $": realtimes.round(ROUND_DIGITS),
+        })
         account_df['差额 $'] = (account_df['实时余额 $'] - account_df['预设余额 $']
                                       ).round(ROUND_DIGITS)
         account_df['差额百分比 %'] = (account_df['差额 $'] / account_df['预设余额 $'] * 100
                                                  ).round(ROUND_DIGITS)
+        account_df['实时余额更新'] = [balance.status for balance in self.realtime_balances]
         return account_df
 
     @property
     def record_df(self) -> pd.DataFrame:
-        record_by_date = {}
-        for record in self.strategy_balance_records:
-            record_date = record.timestamp.strftime('%Y-%m-%d')
-            if record_date not in record_by_date:
-                record_by_date[record_date] = {}
-            record_by_date[record_date] = record_by_date[record_date] | {record.name: record.balance}
-        record_by_date = [(date, record) for date, record in record_by_date.items()]
-        record_by_date = sorted(record_by_date, key=lambda x: x[0])
-        data = []
-        presets = [balance.balance for balance in self.preset_balances]
-        for date, record in record_by_date:
-            hists = [round(record.get(p.name, float('nan')), ROUND_DIGITS) for p in self.preset_balances]
-            diffs = [round(hist - preset, ROUND_DIGITS) for hist, preset in zip(hists, presets)]
-            percents = [round(diff / preset * 100, ROUND_DIGITS) if not pd.isna(diffs) else float('nan')
-                        for diff, preset in zip(diffs, presets)]
-            hist_sum = sum([h for h in hists if not pd.isna(h)])
-            diff_sum = sum([d for d in diffs if not pd.isna(d)])
-            percent_sum = round(diff_sum / sum(presets) * 100, ROUND_DIGITS)
-            data.append([date, *hists, hist_sum, *diffs, diff_sum, *percents, percent_sum])
-        columns = ['日期', *[f'{balance.name} $' for balance in self.preset_balances], '总余额 $',
-                   *[f'Δ{balance.name} $' for balance in self.preset_balances], '总差额 $',
-                   *[f'%Δ{balance.name}' for balance in self.preset_balances], '总差额百分比']
-        record_df = pd.DataFrame(data, columns=columns)
+        names = [balance.name for balance in self.preset_balances]
+        presets = np.array([balance.balance for balance in self.preset_balances], dtype=float)
+        records = pd.DataFrame(self.strategy_balance_records, columns=['name', 'balance', 'timestamp'])
+        records['date'] = pd.to_datetime(records['timestamp']).dt.strftime(self.record_time_format)
+        # the last record of a strategy in a given period wins
+        by_date = (records.drop_duplicates(['date', 'name'], keep='last')
+                   .pivot(index='date', columns='name', values='balance')
+                   .reindex(columns=names)
+                   .sort_index())
+        hists = by_date.to_numpy(dtype=float).round(ROUND_DIGITS)
+        diffs = (hists - presets).round(ROUND_DIGITS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percents = (diffs / presets * 100).round(ROUND_DIGITS)
+            hist_sum = np.nansum(hists, axis=1)
+            diff_sum = np.nansum(diffs, axis=1)
+            percent_sum = (diff_sum / presets.sum() * 100).round(ROUND_DIGITS)
+        columns = [*[f'{name} $' for name in names], '总余额 $',
+                   *[f'Δ{name} $' for name in names], '总差额 $',
+                   *[f'%Δ{name}' for name in names], '总差额百分比']
+        record_df = pd.DataFrame(np.column_stack([hists, hist_sum, diffs, diff_sum, percents, percent_sum]),
+                                 columns=columns)
+        record_df.insert(0, '日期', by_date.index.to_numpy())
         return record_df
 
     @classmethod
     def sum_df(cls, balances: List['AccountBalances']) -> pd.DataFrame:
-        summary = []
-        for balance in balances:
-            summary.append((
-                balance.name,
-                round(sum([b.balance for b in balance.preset_balances]), ROUND_DIGITS),
-                round(sum([b.balance for b in balance.realtime_balances]), ROUND_DIGITS),
-            ))
-        sum_df = pd.DataFrame(summary, columns=['账户名称', '总预设余额 $', '总实时余额 $'])
-        sum_df['总差额 $'] = round(sum_df['总实时余额 $'] - sum_df['总预设余额 $'],
-                                             ROUND_DIGITS)
+        sum_df = pd.DataFrame({
+            '账户名称': [balance.name for balance in balances],
+            '总预设余额 $': [np.sum([b.balance for b in balance.preset_balances]) for balance in balances],
+            '总实时余额 $': [np.sum([b.balance for b in balance.realtime_balances]) for balance in balances],
+        }, columns=['账户名称', '总预设余额 $', '总实时余额 $'])
+        sum_df[['总预设余额 $', '总实时余额 $']] = sum_df[['总预设余额 $', '总实时余额 $']].astype(float).round(ROUND_DIGITS)
+        sum_df['总差额 $'] = (sum_df['总实时余额 $'] - sum_df['总预设余额 $']).round(ROUND_DIGITS)
         sum_df['差额百分比 %'] = (sum_df['总差额 $'] / sum_df['总预设余额 $'] * 100
                                              ).round(ROUND_DIGITS)
         return sum_df
@@ -0,0 +1,273 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import ccxt
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+EXCHANGE_IDLE_TTL = int(os.getenv('EXCHANGE_IDLE_TTL', 900))  # seconds before an unused client is closed
+MARKETS_TTL = int(os.getenv('MARKETS_TTL', 3600))  # seconds before market metadata is re-downloaded
+TICKERS_TTL = float(os.getenv('TICKERS_TTL', 10))  # seconds a bulk ticker snapshot is shared between strategies
+REPORTING_CURRENCY = 'USDT'  # currency every balance is valued in
+
+
+@dataclass
+class PooledClient:
+    exchange: ccxt.Exchange
+    credentials: Tuple[str, Optional[str]]
+    last_used: float
+    markets_loaded_at: float = 0.0
+
+
+@dataclass
+class MarketTable:
+    markets: Dict
+    currencies: Dict
+    loaded_at: float
+
+
+@dataclass
+class TickerSnapshot:
+    prices: 'PriceGraph'
+    fetched_at: float
+
+
+class ExchangePool:
+    """
+    Process-wide ccxt clients keyed by (exchange_type, api_key).
+
+    Every client keeps its own HTTP session so connections are reused between refreshes, and clients idle
+    for longer than `idle_ttl` are closed. Market metadata is downloaded once per exchange type and shared by
+    every client of that type until it is older than `markets_ttl`, and so is one bulk ticker snapshot until it is
+    older than `tickers_ttl`.
+    """
+
+    def __init__(self, idle_ttl: int = EXCHANGE_IDLE_TTL, markets_ttl: int = MARKETS_TTL,
+                 tickers_ttl: float = TICKERS_TTL):
+        self.idle_ttl = idle_ttl
+        self.markets_ttl = markets_ttl
+        self.tickers_ttl = tickers_ttl
+        self._clients: Dict[Tuple[str, str], PooledClient] = {}
+        self._markets: Dict[str, MarketTable] = {}
+        self._tickers: Dict[str, TickerSnapshot] = {}
+        self._lock = threading.Lock()
+        self._market_locks: Dict[str, threading.Lock] = {}
+        self._ticker_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, exchange_type: str, api_key: str, secret_key: str, passphrase: str = None) -> ccxt.Exchange:
+        exchange_type = exchange_type.lower()
+        key = (exchange_type, api_key)
+        credentials = (secret_key, passphrase)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            client = self._clients.get(key)
+            if client is None or client.credentials != credentials:
+                if client is not None:
+                    self._close(client.exchange)
+                exchange_class = getattr(ccxt, exchange_type)
+                exchange = exchange_class({
+                    'apiKey': api_key,
+                    'secret': secret_key,
+                    'password': passphrase,
+                    'enableRateLimit': True,
+                })
+                client = PooledClient(exchange=exchange, credentials=credentials, last_used=now)
+                self._clients[key] = client
+            client.last_used = now
+        table = self.markets(exchange_type)
+        if client.markets_loaded_at != table.loaded_at:
+            client.exchange.set_markets(table.markets, table.currencies)
+            client.markets_loaded_at = table.loaded_at
+        return client.exchange
+
+    def markets(self, exchange_type: str) -> MarketTable:
+        """Shared market metadata for `exchange_type`, downloaded at most once per TTL."""
+        exchange_type = exchange_type.lower()
+        with self._lock:
+            market_lock = self._market_locks.setdefault(exchange_type, threading.Lock())
+        with market_lock:
+            table = self._markets.get(exchange_type)
+            if table is None or time.monotonic() - table.loaded_at > self.markets_ttl:
+                exchange = getattr(ccxt, exchange_type)()
+                exchange.load_markets()
+                table = MarketTable(markets=exchange.markets, currencies=exchange.currencies,
+                                    loaded_at=time.monotonic())
+                self._markets[exchange_type] = table
+                self._close(exchange)
+                logger.info(f"Loaded {len(table.markets)} markets for {exchange_type}")
+            return table
+
+    def prices(self, exchange_type: str) -> 'PriceGraph':
+        """Price graph over every ticker of `exchange_type`, downloaded at most once per TTL."""
+        exchange_type = exchange_type.lower()
+        with self._lock:
+            ticker_lock = self._ticker_locks.setdefault(exchange_type, threading.Lock())
+        # concurrent misses wait for the one download in flight instead of each fetching every ticker
+        with ticker_lock:
+            snapshot = self._tickers.get(exchange_type)
+            if snapshot is None or time.monotonic() - snapshot.fetched_at > self.tickers_ttl:
+                table = self.markets(exchange_type)
+                exchange = getattr(ccxt, exchange_type)({'enableRateLimit': True})
+                exchange.set_markets(table.markets, table.currencies)
+                try:
+                    snapshot = TickerSnapshot(prices=PriceGraph.from_tickers(exchange.fetch_tickers()),
+                                              fetched_at=time.monotonic())
+                finally:
+                    self._close(exchange)
+                self._tickers[exchange_type] = snapshot
+            return snapshot.prices
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                self._close(client.exchange)
+            self._clients.clear()
+
+    def _evict_idle(self, now: float):
+        idle_keys = [key for key, client in self._clients.items() if now - client.last_used > self.idle_ttl]
+        for key in idle_keys:
+            self._close(self._clients.pop(key).exchange)
+        if idle_keys:
+            logger.info(f"Evicted {len(idle_keys)} idle exchange clients")
+
+    @staticmethod
+    def _close(exchange: ccxt.Exchange):
+        session = getattr(exchange, 'session', None)
+        if session is not None:
+            session.close()
+
+
+exchange_pool = ExchangePool()
+
+
+# Valuation Helpers
+class PriceGraph:
+    """
+    Conversion graph over one ticker snapshot: a spot market BASE/QUOTE at price p lets BASE convert to QUOTE at
+    p and QUOTE to BASE at 1 / p.
+
+    Every currency is resolved into `target` by one breadth-first search from the target, so each takes its
+    fewest-hop path and, among equally short ones, the path through the market with the most quote volume (in
+    target terms). Resolved rates are memoized for the lifetime of the graph, i.e. of the snapshot.
+    """
+
+    def __init__(self, prices: Dict[str, float], volumes: Dict[str, float] = None, target: str = REPORTING_CURRENCY):
+        self.target = target
+        self._edges: Dict[str, List[Tuple[str, str, float, float]]] = defaultdict(list)
+        for symbol, price in prices.items():
+            # derivatives (BASE/QUOTE:SETTLE) trade away from spot, only spot markets convert
+            if not price or ':' in symbol or '/' not in symbol:
+                continue
+            base, quote = symbol.split('/')
+            volume = (volumes or {}).get(symbol) or 0.0
+            # (neighbour, symbol, neighbour rate per own rate, quote volume)
+            self._edges[quote].append((base, symbol, price, volume))
+            self._edges[base].append((quote, symbol, 1 / price, volume))
+        self._rates: Optional[Dict[str, float]] = None
+        self._via: Dict[str, Tuple[str, str]] = {}
+
+    @classmethod
+    def from_tickers(cls, tickers: Dict[str, Dict], target: str = REPORTING_CURRENCY) -> 'PriceGraph':
+        return cls({symbol: ticker.get('last') for symbol, ticker in tickers.items()},
+                   {symbol: ticker.get('quoteVolume') for symbol, ticker in tickers.items()}, target)
+
+    @classmethod
+    def from_markets(cls, markets: Dict, target: str = REPORTING_CURRENCY) -> 'PriceGraph':
+        """Graph of which markets connect which currencies, for choosing the symbols to fetch."""
+        return cls(dict.fromkeys(markets, 1.0), target=target)
+
+    def rates(self) -> Dict[str, float]:
+        if self._rates is None:
+            self._rates = self._resolve()
+        return self._rates
+
+    def rate(self, currency: str) -> Optional[float]:
+        return self.rates().get(currency)
+
+    def path(self, currency: str) -> List[str]:
+        """Symbols converting `currency` into the target, empty when it is the target or unreachable."""
+        self.rates()
+        symbols = []
+        while currency in self._via:
+            symbol, currency = self._via[currency]
+            symbols.append(symbol)
+        return symbols
+
+    def _resolve(self) -> Dict[str, float]:
+        rates = {self.target: 1.0}
+        frontier = [self.target]
+        while frontier:
+            # currency -> (liquidity, symbol, parent, rate) of its best edge into the resolved layer
+            best: Dict[str, Tuple[float, str, str, float]] = {}
+            for currency in frontier:
+                for neighbour, symbol, factor, volume in self._edges[currency]:
+                    if neighbour in rates:
+                        continue
+                    rate = rates[currency] * factor
+                    quote_rate = rates[currency] if symbol.endswith(f"/{currency}") else rate
+                    candidate = (volume * quote_rate, symbol, currency, rate)
+                    if neighbour not in best or candidate[:2] > best[neighbour][:2]:
+                        best[neighbour] = candidate
+            for currency, (_, symbol, parent, rate) in best.items():
+                rates[currency] = rate
+                self._via[currency] = (symbol, parent)
+            frontier = list(best)
+        return rates
+
+
+def required_symbols(currencies: List[str], markets: Dict) -> List[str]:
+    """Symbols on the fewest-hop market path from each of `currencies` into USDT."""
+    graph = PriceGraph.from_markets(markets)
+    return sorted({symbol for currency in currencies for symbol in graph.path(currency)})
+
+
+def fetch_price_snapshot(exchange: ccxt.Exchange, symbols: List[str]) -> PriceGraph:
+    """
+    Price graph over every ticker, from the bulk snapshot the pool shares per exchange when the exchange supports
+    `fetch_tickers`; otherwise over `symbols` only, fetched one by one.
+    """
+    if exchange.has.get('fetchTickers'):
+        try:
+            return exchange_pool.prices(exchange.id)
+        except Exception as e:
+            logger.warning(f"Bulk ticker fetch failed on {exchange.id}, falling back to per-symbol calls: {str(e)}")
+    return PriceGraph.from_tickers({symbol: exchange.fetch_ticker(symbol) for symbol in symbols})
+
+
+def non_zero_totals(balance: Dict) -> Dict[str, float]:
+    return {currency: amount for currency, amount in balance['total'].items() if amount and amount > 0}
+
+
+def value_holdings(holdings: Dict[str, float], prices: PriceGraph, unvalued: Set[str] = None) -> float:
+    """USDT value of `holdings`; with `unvalued`, each asset that cannot be valued is only warned about once."""
+    total_usdt_value = 0.0
+    for currency, amount in holdings.items():
+        rate = prices.rate(currency)
+        if rate is None:
+            if unvalued is None or currency not in unvalued:
+                logger.warning(f"Unable to value {currency} in {prices.target}.")
+            if unvalued is not None:
+                unvalued.add(currency)
+            continue
+        total_usdt_value += amount * rate
+    return total_usdt_value
+
+
+def sum_coin_to_usdt(exchange: ccxt.Exchange) -> float:
+    markets = exchange.load_markets()
+    holdings = non_zero_totals(exchange.fetch_balance())
+    prices = fetch_price_snapshot(exchange, required_symbols(list(holdings), markets))
+    total_usdt_value = value_holdings(holdings, prices)
+    logger.info(f"Total Balance in USDT: {total_usdt_value:.2f}")
+    return total_usdt_value
@@ -0,0 +1,154 @@
+"""
+Versioned schema migrations for the gr_ tables.
+
+Run `python gr_migrations.py` (or `run_migrations()` at startup) to bring a database up to date. New tables are
+created from the models first; each pending migration then runs in its own transaction and is recorded in
+`gr_schema_version`. Migrations are written to be safe on a database freshly created from the current models.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List
+
+from loguru import logger
+from sqlalchemy import Column, DateTime, Integer, String, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from gr_db import (APP_PREFIX, Account, AccountBalanceHistory, Base, Strategy,
+                   StrategyBalanceRollup, UserAccountAssociation, engine)
+from gr_rollup import rebuild_rollups
+
+
+class SchemaVersion(Base):
+    __tablename__ = APP_PREFIX + 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(upgrade: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        return upgrade
+
+    return register
+
+
+def _columns(conn: Connection, table_name: str) -> List[str]:
+    return [column['name'] for column in inspect(conn).get_columns(table_name)]
+
+
+def _create_index(conn: Connection, index_name: str):
+    """Create an index declared on the models, unless it already exists."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name == index_name:
+                index.create(conn, checkfirst=True)
+                return
+    raise KeyError(f"Index {index_name} is not declared on any model")
+
+
+@migration(1, "Index the dashboard query paths")
+def _index_query_paths(conn: Connection):
+    _create_index(conn, 'ix_gr_account_balance_history_account_id_timestamp')
+
+
+@migration(2, "Link strategies to accounts by id")
+def _add_strategy_account_id(conn: Connection):
+    strategies, accounts = Strategy.__tablename__, Account.__tablename__
+    if 'account_id' not in _columns(conn, strategies):
+        conn.execute(text(f"ALTER TABLE {strategies} ADD COLUMN account_id INTEGER REFERENCES {accounts}(id)"))
+    conn.execute(text(
+        f"UPDATE {strategies} SET account_id = "
+        f"(SELECT {accounts}.id FROM {accounts} WHERE {accounts}.account_name = {strategies}.account_name) "
+        f"WHERE account_id IS NULL"))
+    _check_strategies_linked(conn)
+
+
+def _check_strategies_linked(conn: Connection):
+    # an unlinked strategy would silently drop out of every account query, so it is reported rather than guessed
+    unlinked = conn.execute(text(
+        f"SELECT id, account_name, strategy_name FROM {Strategy.__tablename__} WHERE account_id IS NULL")).all()
+    if unlinked:
+        raise Exception(f"Strategies without a matching account must be relinked or removed before migrating: "
+                        f"{unlinked}")
+
+
+@migration(3, "Enforce uniqueness the code already assumes")
+def _add_unique_indexes(conn: Connection):
+    # duplicate links and same-day snapshots carry no information, keep the newest row of each
+    for table, columns in ((UserAccountAssociation.__tablename__, 'user_id, account_id'),
+                           (AccountBalanceHistory.__tablename__, 'strategy_id, timestamp')):
+        deleted = conn.execute(text(
+            f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {columns})")).rowcount
+        if deleted:
+            logger.warning(f"Removed {deleted} duplicate rows from {table}")
+    # duplicate strategies hold credentials, so they are reported rather than deleted
+    duplicates = conn.execute(text(
+        f"SELECT account_id, strategy_name FROM {Strategy.__tablename__} "
+        f"GROUP BY account_id, strategy_name HAVING COUNT(*) > 1")).all()
+    if duplicates:
+        raise Exception(f"Duplicate strategies must be removed before migrating: {duplicates}")
+    _create_index(conn, 'ix_gr_user_accounts_association_user_id_account_id')
+    _create_index(conn, 'ix_gr_account_balance_history_strategy_id_timestamp')
+    _create_index(conn, 'ix_gr_strategies_account_id_strategy_name')
+
+
+@migration(4, "Backfill daily, weekly and monthly balance rollups")
+def _backfill_rollups(conn: Connection):
+    db = Session(bind=conn)
+    try:
+        rebuild_rollups(db)
+    finally:
+        db.close()
+
+
+@migration(5, "Store full snapshot timestamps")
+def _timestamp_columns(conn: Connection):
+    if conn.dialect.name != 'postgresql':
+        return  # other backends keep whatever value is written
+    for table, column in ((AccountBalanceHistory.__tablename__, 'timestamp'),
+                          (StrategyBalanceRollup.__tablename__, 'last_timestamp')):
+        conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE TIMESTAMP'))
+
+
+@migration(6, "Require every strategy to belong to an account")
+def _require_strategy_account_id(conn: Connection):
+    # databases that ran migration 2 before it checked for unmatched account names
+    _check_strategies_linked(conn)
+    if conn.dialect.name != 'postgresql':
+        return  # other backends keep the nullable column, new rows always carry an account_id
+    conn.execute(text(f"ALTER TABLE {Strategy.__tablename__} ALTER COLUMN account_id SET NOT NULL"))
+
+
+def run_migrations(bind: Engine = engine) -> List[int]:
+    """Apply all pending migrations in order and return the versions applied."""
+    Base.metadata.create_all(bind=bind)
+    with bind.connect() as conn:
+        applied = {row.version for row in conn.execute(text(f"SELECT version FROM {SchemaVersion.__tablename__}"))}
+    newly_applied = []
+    for pending in sorted(MIGRATIONS, key=lambda m: m.version):
+        if pending.version in applied:
+            continue
+        with bind.begin() as conn:
+            pending.upgrade(conn)
+            conn.execute(SchemaVersion.__table__.insert().values(
+                version=pending.version, description=pending.description, applied_at=datetime.now()))
+        newly_applied.append(pending.version)
+        logger.info(f"Applied migration {pending.version}: {pending.description}")
+    return newly_applied
+
+
+if __name__ == '__main__':
+    run_migrations()
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import ccxt.pro as ccxt_pro
+from dotenv import load_dotenv
+from loguru import logger
+
+from gr_exchange import PriceGraph, exchange_pool, non_zero_totals, required_symbols, value_holdings
+from gr_snapshot import StrategyCredentials
+
+load_dotenv()
+
+LIVE_VALUATION = os.getenv('LIVE_VALUATION', 'false').lower() in ('1', 'true', 'yes')  # stream where supported
+LIVE_BACKOFF_MAX = 60  # seconds between resubscribe attempts at most
+LIVE_TICKER_STALE_AFTER = float(os.getenv('LIVE_TICKER_STALE_AFTER', 120))  # seconds before live prices count as frozen
+
+
+@dataclass(frozen=True)
+class BalanceEntry:
+    value: float
+    fetched_at: Optional[datetime]
+    error: Optional[str] = None
+
+
+class BalanceStore:
+    """Latest realtime balance per strategy id, written by background refreshers and read by the dashboards."""
+
+    def __init__(self):
+        self._entries: Dict[int, BalanceEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, strategy_id: int) -> Optional[BalanceEntry]:
+        return self._entries.get(strategy_id)
+
+    def set_value(self, strategy_id: int, value: float, fetched_at: datetime = None):
+        with self._lock:
+            self._entries[strategy_id] = BalanceEntry(value=value, fetched_at=fetched_at or datetime.now())
+
+    def set_error(self, strategy_id: int, error: str):
+        """Record a failed refresh, keeping the previous value and its fetch time."""
+        with self._lock:
+            previous = self._entries.get(strategy_id)
+            self._entries[strategy_id] = BalanceEntry(
+                value=previous.value if previous else float('nan'),
+                fetched_at=previous.fetched_at if previous else None,
+                error=error)
+
+    def values(self, strategy_ids: Iterable[int]) -> Dict[int, float]:
+        """Known balances for `strategy_ids`; ids never fetched are left out."""
+        entries = self._entries
+        return {strategy_id: entries[strategy_id].value for strategy_id in strategy_ids
+                if strategy_id in entries and entries[strategy_id].fetched_at is not None}
+
+    def discard(self, strategy_id: int):
+        with self._lock:
+            self._entries.pop(strategy_id, None)
+
+
+def supports_live(exchange_type: str) -> bool:
+    exchange_class = getattr(ccxt_pro, exchange_type, None)
+    if exchange_class is None:
+        return False
+    has = exchange_class().has
+    return bool(has.get('watchBalance') and has.get('watchTickers'))
+
+
+async def _fetch_tickers(exchange, symbols: List[str]) -> Dict[str, Dict]:
+    if exchange.has.get('fetchTickers'):
+        return await exchange.fetch_tickers(symbols)
+    return dict(zip(symbols, await asyncio.gather(*(exchange.fetch_ticker(symbol) for symbol in symbols))))
+
+
+class TickerFeed:
+    """
+    Last tickers of one exchange type from `watch_tickers`, shared by every live strategy on that exchange.
+
+    The subscription grows with the symbols strategies need; listeners are called after every update. The price
+    graph is rebuilt at most once per update, however many strategies read it.
+    """
+
+    def __init__(self, exchange_type: str):
+        self.exchange_type = exchange_type
+        self.exchange = getattr(ccxt_pro, exchange_type)({'enableRateLimit': True})
+        self.tickers: Dict[str, Dict] = {}
+        self.updated_at = 0.0
+        self._graph: Optional[PriceGraph] = None
+        self._symbols: Set[str] = set()
+        self._listeners: Set[Callable[[], None]] = set()
+        self._subscribed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, symbols: Iterable[str], listener: Callable[[], None]):
+        self._listeners.add(listener)
+        if not self._symbols.issuperset(symbols):
+            self._symbols.update(symbols)
+            self._subscribed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._follow())
+
+    def unsubscribe(self, listener: Callable[[], None]):
+        self._listeners.discard(listener)
+
+    def update(self, tickers: Dict[str, Dict]):
+        self.tickers.update({symbol: ticker for symbol, ticker in tickers.items() if ticker.get('last')})
+        self.updated_at = time.monotonic()
+        self._graph = None
+
+    def fresh(self) -> bool:
+        """Whether prices arrived recently, a failing stream leaves them frozen."""
+        return time.monotonic() - self.updated_at < LIVE_TICKER_STALE_AFTER
+
+    @property
+    def graph(self) -> PriceGraph:
+        if self._graph is None:
+            self._graph = PriceGraph.from_tickers(self.tickers)
+        return self._graph
+
+    async def _follow(self):
+        table = await asyncio.to_thread(exchange_pool.markets, self.exchange_type)
+        self.exchange.set_markets(table.markets, table.currencies)
+        backoff = 1
+        while True:
+            try:
+                await self._subscribed.wait()
+                self.update(await self.exchange.watch_tickers(sorted(self._symbols)))
+                for listener in list(self._listeners):
+                    listener()
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"{self.exchange_type} ticker stream failed, resubscribing in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, LIVE_BACKOFF_MAX)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.exchange.close()
+
+
+class LiveStrategy:
+    """One strategy valued from `watch_balance` and its exchange's ticker feed, written to the balance store."""
+
+    def __init__(self, cred: StrategyCredentials, feed: TickerFeed, store: BalanceStore):
+        self.cred = cred
+        self.feed = feed
+        self.store = store
+        self.exchange = getattr(ccxt_pro, cred.exchange_type)({
+            'apiKey': cred.api_key,
+            'secret': cred.secret_key,
+            'password': cred.passphrase,
+            'enableRateLimit': True,
+        })
+        self.holdings: Dict[str, float] = {}
+        self.symbols: List[str] = []
+        self.healthy = False
+        self._unvalued: Set[str] = set()
+        self._task = asyncio.create_task(self._follow())
+
+    async def _follow(self):
+        table = await asyncio.to_thread(exchange_pool.markets, self.cred.exchange_type)
+        self.exchange.set_markets(table.markets, table.currencies)
+        backoff = 1
+        while True:
+            try:
+                # snapshot first, the stream only reports changes on some exchanges
+                await self._update(await self.exchange.fetch_balance(), table.markets)
+                while True:
+                    await self._update(await self.exchange.watch_balance(), table.markets)
+                    backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.healthy = False
+                self.store.set_error(self.cred.id, str(e))
+                logger.warning(f"Live balance of {self.cred.name} failed, resubscribing in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, LIVE_BACKOFF_MAX)
+
+    async def _update(self, balance: Dict, markets: Dict):
+        self.holdings = non_zero_totals(balance)
+        self.symbols = required_symbols(list(self.holdings), markets)
+        missing = [symbol for symbol in self.symbols if symbol not in self.feed.tickers]
+        if missing:
+            self.feed.update(await _fetch_tickers(self.exchange, missing))
+        self.feed.subscribe(self.symbols, self.revalue)
+        self.healthy = True
+        self.revalue()
+
+    @property
+    def live(self) -> bool:
+        """Balance stream up and, when prices are needed, ticker feed current."""
+        return self.healthy and (not self.symbols or self.feed.fresh())
+
+    def revalue(self):
+        if self.live:
+            # called on every tick, each unvaluable asset is reported once per subscription
+            self.store.set_value(self.cred.id, value_holdings(self.holdings, self.feed.graph, self._unvalued))
+
+    async def close(self):
+        self.feed.unsubscribe(self.revalue)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.exchange.close()
+
+
+class LiveValuator:
+    """
+    Streams the balances of strategies whose exchange supports `watchBalance` and `watchTickers`, keeping their
+    USDT value in the balance store within seconds of a fill. Strategies on other exchanges, or whose stream is
+    down, are left to REST polling. Must run on one long-lived event loop.
+    """
+
+    def __init__(self, store: BalanceStore):
+        self.store = store
+        self._strategies: Dict[int, LiveStrategy] = {}
+        self._feeds: Dict[str, TickerFeed] = {}
+        self._supported: Dict[str, bool] = {}
+
+    def supports(self, exchange_type: str) -> bool:
+        if exchange_type not in self._supported:
+            self._supported[exchange_type] = supports_live(exchange_type)
+        return self._supported[exchange_type]
+
+    def is_live(self, strategy_id: int) -> bool:
+        strategy = self._strategies.get(strategy_id)
+        return strategy is not None and strategy.live
+
+    async def sync(self, credentials: List[StrategyCredentials]):
+        """Subscribe new or edited strategies and drop the ones no longer in `credentials`."""
+        wanted = {cred.id: cred for cred in credentials if self.supports(cred.exchange_type)}
+        for strategy_id in list(self._strategies):
+            if self._strategies[strategy_id].cred != wanted.get(strategy_id):
+                await self._strategies.pop(strategy_id).close()
+        for strategy_id, cred in wanted.items():
+            if strategy_id not in self._strategies:
+                if cred.exchange_type not in self._feeds:
+                    self._feeds[cred.exchange_type] = TickerFeed(cred.exchange_type)
+                self._strategies[strategy_id] = LiveStrategy(cred, self._feeds[cred.exchange_type], self.store)
+
+    async def close(self):
+        await asyncio.gather(*(strategy.close() for strategy in self._strategies.values()),
+                             *(feed.close() for feed in self._feeds.values()), return_exceptions=True)
+        self._strategies.clear()
+        self._feeds.clear()
@@ -0,0 +1,265 @@
+"""
+Daily, weekly and monthly balance rollups per strategy, and the downsampled history queries
+built on them.
+
+Daily buckets are recomputed from the raw `AccountBalanceHistory` rows of that day, weekly and monthly buckets
+from the daily ones, so re-running `update_rollups` for the same snapshots is idempotent. Once a day is rolled up
+its raw rows may be thinned by `prune_raw_history`; rollups of pruned days must then not be recomputed.
+"""
+import math
+import os
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+from sqlalchemy import and_, extract, func, literal_column, or_, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
+from sqlalchemy.orm import Session
+
+from gr_db import AccountBalanceHistory, StrategyBalanceRollup
+
+load_dotenv()
+
+GRANULARITIES = ('day', 'week', 'month')
+INTRADAY_RESOLUTIONS = {'5min': 5, '15min': 15, 'hour': 60}  # minutes per bucket, read from the raw rows
+AGGREGATIONS = ('last', 'mean')
+HISTORY_INTRADAY_RESOLUTION = os.getenv('HISTORY_INTRADAY_RESOLUTION', 'hour')
+HISTORY_INTRADAY_MAX_DAYS = int(os.getenv('HISTORY_INTRADAY_MAX_DAYS', 3))  # longer ranges are shown daily
+HISTORY_DAILY_MAX_DAYS = int(os.getenv('HISTORY_DAILY_MAX_DAYS', 366))  # longer ranges are shown weekly
+HISTORY_WEEKLY_MAX_DAYS = int(os.getenv('HISTORY_WEEKLY_MAX_DAYS', 366 * 3))  # longer ranges are shown monthly
+RAW_HISTORY_RETENTION_DAYS = int(os.getenv('RAW_HISTORY_RETENTION_DAYS', 0))  # 0 keeps raw rows forever
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    if isinstance(day, datetime):
+        day = day.date()
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def bucket_end(start: date, granularity: str) -> date:
+    """First day after the bucket starting at `start`."""
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def pick_granularity(start_date: date, end_date: date) -> str:
+    span = (end_date - start_date).days
+    if span <= HISTORY_DAILY_MAX_DAYS:
+        return 'day'
+    if span <= HISTORY_WEEKLY_MAX_DAYS:
+        return 'week'
+    return 'month'
+
+
+def raw_history_cutoff(retention_days: int = RAW_HISTORY_RETENTION_DAYS) -> Optional[date]:
+    """First day whose raw rows are kept, None when they are kept forever."""
+    if retention_days <= 0:
+        return None
+    return bucket_start(datetime.now(), 'day') - timedelta(days=retention_days)
+
+
+def pick_resolution(start_date: date, end_date: date, intraday: bool = True) -> str:
+    """
+    Intraday resolution for short ranges, otherwise the rollup granularity for the range. Without `intraday`,
+    e.g. with one snapshot per day, short ranges are daily too, as are ranges reaching back past the raw rows
+    `prune_raw_history` keeps.
+    """
+    cutoff = raw_history_cutoff()
+    if (intraday and (end_date - start_date).days <= HISTORY_INTRADAY_MAX_DAYS
+            and (cutoff is None or start_date >= cutoff)):
+        return HISTORY_INTRADAY_RESOLUTION
+    return pick_granularity(start_date, end_date)
+
+
+def _summarize(samples: List[Tuple[float, float, float, float, float, int, date]]) -> Optional[Dict]:
+    """Merge time-ordered (open, high, low, close, total, samples, last_timestamp) rows into one bucket."""
+    samples = [sample for sample in samples if sample[3] is not None and not math.isnan(sample[3])]
+    if not samples:
+        return None
+    return {
+        'open': samples[0][0],
+        'high': max(sample[1] for sample in samples),
+        'low': min(sample[2] for sample in samples),
+        'close': samples[-1][3],
+        'total': sum(sample[4] for sample in samples),
+        'samples': sum(sample[5] for sample in samples),
+        'last_timestamp': samples[-1][6],
+    }
+
+
+def _upsert_strategy_rollups(db: Session, granularity: str, summaries: Dict[Tuple[int, date], Dict],
+                             strategy_accounts: Dict[int, int]):
+    if not summaries:
+        return
+    existing = {(rollup.strategy_id, rollup.bucket_start): rollup
+                for rollup in db.query(StrategyBalanceRollup).filter(
+                    StrategyBalanceRollup.granularity == granularity,
+                    tuple_(StrategyBalanceRollup.strategy_id, StrategyBalanceRollup.bucket_start).in_(list(summaries)))}
+    for (strategy_id, start), summary in summaries.items():
+        rollup = existing.get((strategy_id, start))
+        if rollup is None:
+            rollup = StrategyBalanceRollup(granularity=granularity, strategy_id=strategy_id, bucket_start=start)
+            db.add(rollup)
+        rollup.account_id = strategy_accounts[strategy_id]
+        for column, value in summary.items():
+            setattr(rollup, column, value)
+    db.flush()
+
+
+def _rollup_days(db: Session, days: Set[Tuple[int, date]], strategy_accounts: Dict[int, int]):
+    first_day, last_day = min(day for _, day in days), max(day for _, day in days)
+    rows = db.query(
+        AccountBalanceHistory.strategy_id,
+        AccountBalanceHistory.balance,
+        AccountBalanceHistory.timestamp
+    ).filter(
+        AccountBalanceHistory.strategy_id.in_({strategy_id for strategy_id, _ in days}),
+        AccountBalanceHistory.timestamp >= datetime.combine(first_day, time.min),
+        AccountBalanceHistory.timestamp < datetime.combine(bucket_end(last_day, 'day'), time.min)
+    ).order_by(AccountBalanceHistory.timestamp, AccountBalanceHistory.id).all()
+    samples = defaultdict(list)
+    for strategy_id, balance, timestamp in rows:
+        key = (strategy_id, bucket_start(timestamp, 'day'))
+        if key in days:
+            samples[key].append((balance, balance, balance, balance, balance, 1, timestamp))
+    summaries = {key: summary for key, values in samples.items() if (summary := _summarize(values))}
+    _upsert_strategy_rollups(db, 'day', summaries, strategy_accounts)
+
+
+def _rollup_from_days(db: Session, buckets: Set[Tuple[int, date]], granularity: str,
+                      strategy_accounts: Dict[int, int]):
+    first_day = min(start for _, start in buckets)
+    last_day = bucket_end(max(start for _, start in buckets), granularity)
+    rows = db.query(StrategyBalanceRollup).filter(
+        StrategyBalanceRollup.granularity == 'day',
+        StrategyBalanceRollup.strategy_id.in_({strategy_id for strategy_id, _ in buckets}),
+        StrategyBalanceRollup.bucket_start >= first_day,
+        StrategyBalanceRollup.bucket_start < last_day
+    ).order_by(StrategyBalanceRollup.bucket_start).all()
+    samples = defaultdict(list)
+    for row in rows:
+        key = (row.strategy_id, bucket_start(row.bucket_start, granularity))
+        if key in buckets:
+            samples[key].append((row.open, row.high, row.low, row.close, row.total, row.samples, row.last_timestamp))
+    summaries = {key: summary for key, values in samples.items() if (summary := _summarize(values))}
+    _upsert_strategy_rollups(db, granularity, summaries, strategy_accounts)
+
+
+def update_rollups(db: Session, snapshots: Iterable[Tuple[int, int, date]]):
+    """Recompute every rollup bucket touched by (account_id, strategy_id, timestamp) snapshot rows."""
+    strategy_accounts = {}
+    days = set()
+    for account_id, strategy_id, timestamp in snapshots:
+        strategy_accounts[strategy_id] = account_id
+        days.add((strategy_id, bucket_start(timestamp, 'day')))
+    if not days:
+        return
+    db.flush()
+    _rollup_days(db, days, strategy_accounts)
+    for granularity in ('week', 'month'):
+        _rollup_from_days(db, {(strategy_id, bucket_start(day, granularity)) for strategy_id, day in days},
+                          granularity, strategy_accounts)
+
+
+def rebuild_rollups(db: Session):
+    """Recompute all rollups from the raw history, one strategy at a time."""
+    strategy_ids = [strategy_id for strategy_id, in db.query(AccountBalanceHistory.strategy_id).distinct()]
+    for strategy_id in strategy_ids:
+        rows = db.query(
+            AccountBalanceHistory.account_id,
+            AccountBalanceHistory.strategy_id,
+            AccountBalanceHistory.timestamp
+        ).filter(AccountBalanceHistory.strategy_id == strategy_id).all()
+        update_rollups(db, rows)
+    logger.info(f"Rebuilt balance rollups for {len(strategy_ids)} strategies")
+
+
+def prune_raw_history(db: Session, retention_days: int = RAW_HISTORY_RETENTION_DAYS) -> int:
+    """Delete raw history rows older than `retention_days` whose day is already rolled up."""
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.combine(raw_history_cutoff(retention_days), time.min)
+    rolled_up = db.query(StrategyBalanceRollup.id).filter(
+        StrategyBalanceRollup.granularity == 'day',
+        StrategyBalanceRollup.strategy_id == AccountBalanceHistory.strategy_id,
+        StrategyBalanceRollup.bucket_start == func.date(AccountBalanceHistory.timestamp)
+    ).exists()
+    deleted = db.query(AccountBalanceHistory).filter(
+        AccountBalanceHistory.timestamp < cutoff, rolled_up
+    ).delete(synchronize_session=False)
+    db.commit()
+    logger.info(f"Pruned {deleted} raw balance history rows older than {cutoff}")
+    return deleted
+
+
+def _raw_bucket(minutes: int):
+    """Start of the `minutes` wide bucket holding each raw timestamp, computed by Postgres."""
+    hour = func.date_trunc(literal_column("'hour'"), AccountBalanceHistory.timestamp)
+    if minutes >= 60:
+        return hour
+    width = literal_column(str(minutes))
+    return hour + func.floor(extract('minute', AccountBalanceHistory.timestamp) / width) * width * literal_column(
+        "interval '1 minute'")
+
+
+def _downsample_raw(db: Session, ranges: List[Tuple[int, date, date]], minutes: int, aggregation: str) -> List:
+    balance, timestamp = AccountBalanceHistory.balance, AccountBalanceHistory.timestamp
+    bucket = _raw_bucket(minutes)
+    close = array_agg(aggregate_order_by(balance, timestamp.desc()))[1]
+    value = close if aggregation == 'last' else func.avg(balance)
+    return db.query(AccountBalanceHistory.account_id, AccountBalanceHistory.strategy_id, bucket, value).filter(
+        or_(*[and_(AccountBalanceHistory.account_id == account_id,
+                   timestamp >= datetime.combine(start_date, time.min),
+                   timestamp < datetime.combine(end_date + timedelta(days=1), time.min))
+              for account_id, start_date, end_date in ranges])
+    ).group_by(AccountBalanceHistory.account_id, AccountBalanceHistory.strategy_id, bucket).all()
+
+
+def _downsample_rollups(db: Session, ranges: List[Tuple[int, date, date, str]], aggregation: str) -> List:
+    rollup = StrategyBalanceRollup
+    value = rollup.close if aggregation == 'last' else rollup.total / rollup.samples
+    return db.query(rollup.account_id, rollup.strategy_id, rollup.bucket_start, value).filter(
+        or_(*[and_(rollup.account_id == account_id,
+                   rollup.granularity == granularity,
+                   rollup.bucket_start >= bucket_start(start_date, granularity),
+                   rollup.bucket_start <= end_date)
+              for account_id, start_date, end_date, granularity in ranges])
+    ).all()
+
+
+def downsample_history(db: Session, date_ranges: Dict[int, Tuple[date, date]], resolutions: Dict[int, str],
+                       aggregation: str = 'last') -> List[Tuple]:
+    """
+    Balance history of several accounts, aggregated per bucket by the database.
+
+    Each account id maps to its (start, end) range and its resolution: an intraday resolution reads the raw rows,
+    a granularity reads the rollups. Returns (account_id, strategy_id, bucket, value) rows.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+    intraday, rolled_up = defaultdict(list), []
+    for account_id, (start_date, end_date) in date_ranges.items():
+        resolution = resolutions[account_id]
+        if resolution in INTRADAY_RESOLUTIONS:
+            intraday[INTRADAY_RESOLUTIONS[resolution]].append((account_id, start_date, end_date))
+        else:
+            rolled_up.append((account_id, start_date, end_date, resolution))
+    rows = []
+    for minutes, ranges in intraday.items():
+        rows.extend(_downsample_raw(db, ranges, minutes, aggregation))
+    if rolled_up:
+        rows.extend(_downsample_rollups(db, rolled_up, aggregation))
+    return rows
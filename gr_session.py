@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from gr_db import SessionLocal, SessionToken
+
+load_dotenv()
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')  # memory, or database to share sessions across workers
+SESSION_TTL = int(os.getenv('SESSION_TTL', 12 * 3600))  # seconds a session token stays valid
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 5))  # seconds a worker trusts its cached lookup
+SESSION_CACHE_SIZE = 10000
+
+UserId = Union[int, str]  # user ids are integers, the administrator is 'admin'
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionStore(ABC):
+    """
+    Maps session tokens to user ids with a TTL. Each user holds a single session, logging in again replaces
+    the previous token.
+    """
+
+    @abstractmethod
+    def issue(self, user_id: UserId) -> str:
+        """Start a session for `user_id`, ending its previous one, and return the new token."""
+
+    @abstractmethod
+    def resolve(self, token: str) -> Optional[UserId]:
+        """The user id of a live session, or None for an unknown or expired token."""
+
+    @abstractmethod
+    def revoke(self, token: str) -> bool:
+        """End the session of `token`, returns whether there was one."""
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions held by this process only."""
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+        self._tokens: Dict[str, Tuple[UserId, float]] = {}
+        self._user_tokens: Dict[UserId, str] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user_id: UserId) -> str:
+        token = str(uuid.uuid4())
+        with self._lock:
+            previous = self._user_tokens.pop(user_id, None)
+            if previous:
+                self._tokens.pop(previous, None)
+            self._tokens[token] = (user_id, time.monotonic() + self.ttl)
+            self._user_tokens[user_id] = token
+        return token
+
+    def resolve(self, token: str) -> Optional[UserId]:
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        user_id, expires_at = entry
+        if expires_at < time.monotonic():
+            self.revoke(token)
+            return None
+        return user_id
+
+    def revoke(self, token: str) -> bool:
+        with self._lock:
+            entry = self._tokens.pop(token, None)
+            if entry and self._user_tokens.get(entry[0]) == token:
+                del self._user_tokens[entry[0]]
+        return entry is not None
+
+
+class DatabaseSessionStore(SessionStore):
+    """
+    Sessions kept in the database so every app worker sees them, with a small read-through cache per worker.
+
+    Only token hashes are stored. A revoked token may still be accepted by another worker for up to `cache_ttl`
+    seconds.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL, cache_ttl: float = SESSION_CACHE_TTL):
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[str, Tuple[Optional[UserId], datetime, float]] = {}
+
+    @staticmethod
+    def _decode(user_id: str) -> UserId:
+        return int(user_id) if user_id.isdigit() else user_id
+
+    def issue(self, user_id: UserId) -> str:
+        token = str(uuid.uuid4())
+        now = datetime.now()
+        with SessionLocal() as db:
+            db.query(SessionToken).filter(
+                (SessionToken.user_id == str(user_id)) | (SessionToken.expires_at < now)
+            ).delete(synchronize_session=False)
+            db.add(SessionToken(token_hash=hash_token(token), user_id=str(user_id),
+                                expires_at=now + timedelta(seconds=self.ttl)))
+            db.commit()
+        return token
+
+    def resolve(self, token: str) -> Optional[UserId]:
+        cached = self._cache.get(token)
+        if cached is None or cached[2] < time.monotonic():
+            with SessionLocal() as db:
+                row = db.query(SessionToken.user_id, SessionToken.expires_at).filter(
+                    SessionToken.token_hash == hash_token(token)).first()
+            cached = (self._decode(row.user_id) if row else None, row.expires_at if row else datetime.min,
+                      time.monotonic() + self.cache_ttl)
+            if len(self._cache) >= SESSION_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[token] = cached
+        user_id, expires_at, _ = cached
+        if user_id is None or expires_at < datetime.now():
+            return None
+        return user_id
+
+    def revoke(self, token: str) -> bool:
+        self._cache.pop(token, None)
+        with SessionLocal() as db:
+            deleted = db.query(SessionToken).filter(
+                SessionToken.token_hash == hash_token(token)).delete(synchronize_session=False)
+            db.commit()
+        return deleted > 0
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'database':
+        return DatabaseSessionStore()
+    raise ValueError(f"Unknown session backend: {backend}")
+
+
+session_store = create_session_store()
+logger.info(f"Using {SESSION_BACKEND} session store")
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import ccxt.async_support as ccxt_async
+from dotenv import load_dotenv
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from gr_db import AccountBalanceHistory, Strategy
+from gr_exchange import (EXCHANGE_IDLE_TTL, PooledClient, PriceGraph, exchange_pool, non_zero_totals,
+                         required_symbols, value_holdings)
+
+load_dotenv()
+
+SNAPSHOT_CONCURRENCY = int(os.getenv('SNAPSHOT_CONCURRENCY', 32))  # strategies in flight overall
+SNAPSHOT_EXCHANGE_CONCURRENCY = int(os.getenv('SNAPSHOT_EXCHANGE_CONCURRENCY', 8))  # strategies in flight per exchange
+SNAPSHOT_TIMEOUT = float(os.getenv('SNAPSHOT_TIMEOUT', 30))  # seconds allowed per strategy
+SNAPSHOT_INSERT_BATCH = int(os.getenv('SNAPSHOT_INSERT_BATCH', 1000))  # rows per multi-row INSERT
+
+
+@dataclass(frozen=True)
+class StrategyCredentials:
+    id: int
+    name: str
+    exchange_type: str
+    api_key: str
+    secret_key: str
+    passphrase: Optional[str]
+
+    @classmethod
+    def from_strategy(cls, strategy: Strategy) -> 'StrategyCredentials':
+        return cls(id=int(strategy.id), name=str(strategy.strategy_name),
+                   exchange_type=str(strategy.exchange_type).lower(), api_key=strategy.api_key,
+                   secret_key=strategy.secret_key, passphrase=strategy.passphrase)
+
+
+@dataclass
+class SnapshotResult:
+    balances: Dict[int, float] = field(default_factory=dict)
+    failures: Dict[int, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+
+class SnapshotEngine:
+    """
+    Fetches the USDT balance of many strategies concurrently with ccxt's async clients.
+
+    Concurrency is capped globally and per exchange type, each strategy gets `timeout` seconds, and public
+    tickers are fetched once per exchange type and shared by every strategy on that exchange.
+
+    Clients are pooled by (exchange_type, api_key) and kept between runs, so they are bound to one event loop:
+    always run the engine on the same `BackgroundLoop`. Clients unused for `idle_ttl` seconds are closed.
+    """
+
+    def __init__(self, concurrency: int = SNAPSHOT_CONCURRENCY,
+                 exchange_concurrency: int = SNAPSHOT_EXCHANGE_CONCURRENCY, timeout: float = SNAPSHOT_TIMEOUT,
+                 idle_ttl: int = EXCHANGE_IDLE_TTL):
+        self.concurrency = concurrency
+        self.exchange_concurrency = exchange_concurrency
+        self.timeout = timeout
+        self.idle_ttl = idle_ttl
+        self._clients: Dict[Tuple[str, Optional[str]], PooledClient] = {}
+
+    async def fetch_balances(self, strategies: List[Strategy]) -> SnapshotResult:
+        started = time.monotonic()
+        await self.evict_idle()
+        credentials = [StrategyCredentials.from_strategy(strategy) for strategy in strategies]
+        global_limit = asyncio.Semaphore(self.concurrency)
+        exchange_limits = defaultdict(lambda: asyncio.Semaphore(self.exchange_concurrency))
+        ticker_tasks: Dict[str, asyncio.Task] = {}
+        result = SnapshotResult()
+
+        async def run(cred: StrategyCredentials):
+            async with global_limit, exchange_limits[cred.exchange_type]:
+                try:
+                    result.balances[cred.id] = await asyncio.wait_for(
+                        self._fetch_one(cred, ticker_tasks), self.timeout)
+                except asyncio.TimeoutError:
+                    result.failures[cred.id] = f"timed out after {self.timeout}s"
+                except Exception as e:
+                    result.failures[cred.id] = str(e)
+                if cred.id in result.failures:
+                    logger.error(f"Failed to retrieve balance for {cred.name}: {result.failures[cred.id]}")
+
+        await asyncio.gather(*(run(cred) for cred in credentials))
+        result.elapsed = time.monotonic() - started
+        logger.info(f"Fetched {len(result.balances)}/{len(credentials)} strategy balances "
+                    f"in {result.elapsed:.1f}s, {len(result.failures)} failed")
+        return result
+
+    async def _fetch_one(self, cred: StrategyCredentials, ticker_tasks: Dict[str, asyncio.Task]) -> float:
+        exchange, table = await self._client(cred.exchange_type, cred.api_key, cred.secret_key, cred.passphrase)
+        holdings = non_zero_totals(await exchange.fetch_balance())
+        prices = await self._fetch_prices(exchange, holdings, table.markets, ticker_tasks)
+        return value_holdings(holdings, prices)
+
+    async def _fetch_prices(self, exchange, holdings: Dict[str, float], markets: Dict,
+                            ticker_tasks: Dict[str, asyncio.Task]) -> PriceGraph:
+        if exchange.has.get('fetchTickers'):
+            if exchange.id not in ticker_tasks:
+                ticker_tasks[exchange.id] = asyncio.create_task(self._fetch_all_tickers(exchange.id))
+            try:
+                # holdings without a path in the snapshot (earn tokens, delisted coins) have none in the markets
+                # either, value_holdings logs and skips them
+                return await asyncio.shield(ticker_tasks[exchange.id])
+            except Exception as e:
+                logger.warning(f"Bulk ticker fetch failed on {exchange.id}, falling back to per-symbol calls: "
+                               f"{str(e)}")
+        symbols = required_symbols(list(holdings), markets)
+        tickers = await asyncio.gather(*(exchange.fetch_ticker(symbol) for symbol in symbols), return_exceptions=True)
+        for symbol, ticker in zip(symbols, tickers):
+            if isinstance(ticker, Exception):
+                logger.warning(f"Failed to fetch {symbol} ticker on {exchange.id}: {str(ticker)}")
+        return PriceGraph.from_tickers({symbol: ticker for symbol, ticker in zip(symbols, tickers)
+                                        if not isinstance(ticker, Exception)})
+
+    async def _fetch_all_tickers(self, exchange_type: str) -> PriceGraph:
+        exchange, _ = await self._client(exchange_type)
+        return PriceGraph.from_tickers(await exchange.fetch_tickers())
+
+    async def _client(self, exchange_type: str, api_key: str = None, secret_key: str = None, passphrase: str = None):
+        """Pooled async client for the credentials (a public one without `api_key`) and the shared market table."""
+        table = await asyncio.to_thread(exchange_pool.markets, exchange_type)
+        key = (exchange_type, api_key)
+        credentials = (secret_key, passphrase)
+        client = self._clients.get(key)
+        if client is None or client.credentials != credentials:
+            stale = client
+            config = {'enableRateLimit': True}
+            if api_key is not None:
+                config.update({'apiKey': api_key, 'secret': secret_key, 'password': passphrase})
+            client = PooledClient(exchange=getattr(ccxt_async, exchange_type)(config), credentials=credentials,
+                                  last_used=0.0)
+            self._clients[key] = client
+            if stale is not None:
+                await stale.exchange.close()
+        client.last_used = time.monotonic()
+        if client.markets_loaded_at != table.loaded_at:
+            client.exchange.set_markets(table.markets, table.currencies)
+            client.markets_loaded_at = table.loaded_at
+        return client.exchange, table
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        idle_keys = [key for key, client in self._clients.items() if now - client.last_used > self.idle_ttl]
+        await asyncio.gather(*(self._clients.pop(key).exchange.close() for key in idle_keys), return_exceptions=True)
+        if idle_keys:
+            logger.info(f"Evicted {len(idle_keys)} idle async exchange clients")
+
+    async def close(self):
+        clients, self._clients = list(self._clients.values()), {}
+        await asyncio.gather(*(client.exchange.close() for client in clients), return_exceptions=True)
+
+
+snapshot_engine = SnapshotEngine()
+
+
+def insert_balance_snapshots(db: Session, rows: List[Dict], upsert: bool = True) -> int:
+    """
+    Write snapshot rows (dicts of account_id, strategy_id, balance, timestamp) with multi-row INSERTs.
+
+    With `upsert`, a row whose (strategy_id, timestamp) already exists overwrites it, so re-running a snapshot is
+    idempotent. Like the history downsampling, this needs Postgres. Nothing is committed here.
+    """
+    table = AccountBalanceHistory.__table__
+    for start in range(0, len(rows), SNAPSHOT_INSERT_BATCH):
+        batch = rows[start:start + SNAPSHOT_INSERT_BATCH]
+        statement = pg_insert(table).values(batch)
+        if upsert:
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.strategy_id, table.c.timestamp],
+                set_={'account_id': statement.excluded.account_id, 'balance': statement.excluded.balance})
+        db.execute(statement)
+    return len(rows)
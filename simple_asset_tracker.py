@@ -1,217 +1,614 @@
-from traceback import format_exc
-from typing import Dict
+import asyncio
+import os
+import time
+from types import MappingProxyType
+from typing import Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
 
-from binance import AsyncClient, Client
+import aiohttp
+from binance import AsyncClient, BinanceSocketManager
+from binance.exceptions import BinanceAPIException
+from dotenv import load_dotenv
 from loguru import logger
 
+load_dotenv()
+
+PRICE_CACHE_TTL = float(os.getenv('PRICE_CACHE_TTL', 10))  # seconds ticker prices are shared before refetching
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 100))  # open connections shared by all trackers
+STREAM_START_TIMEOUT = float(os.getenv('STREAM_START_TIMEOUT', 30))  # seconds to connect and take the first snapshot
+STREAM_RESYNC_INTERVAL = float(os.getenv('STREAM_RESYNC_INTERVAL', 1800))  # seconds between full REST resyncs
+STREAM_POSITION_REFRESH = float(os.getenv('STREAM_POSITION_REFRESH', 30))  # seconds between open-position resyncs
+STREAM_RESYNC_DEBOUNCE = 1  # seconds of account events batched into one resync
+STREAM_STALE_AFTER = 60  # seconds without a ticker message before prices fall back to REST
+STREAM_IDLE_TTL = float(os.getenv('STREAM_IDLE_TTL', 900))  # seconds unread before a streaming tracker stops
+# invalid key, IP or permissions for the action, margin account does not exist
+SECTION_UNAVAILABLE_CODES = (-2015, -3003)
+_connectors: Dict[asyncio.AbstractEventLoop, aiohttp.TCPConnector] = {}
+
+
+class PriceCache:
+    """
+    Asset -> USDT price map shared by all trackers in the process, kept for `ttl` seconds.
+
+    Prices are public, so one download serves every credential. Concurrent misses on the same event loop wait
+    for a single in-flight fetch instead of each downloading the full ticker list. Only the derived, read-only
+    asset -> price map is kept, not the raw tickers.
+    """
+
+    def __init__(self, ttl: float = PRICE_CACHE_TTL):
+        self.ttl = ttl
+        self._prices: Optional[Mapping[str, float]] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def get(self, fetch: Callable[[], Awaitable[Mapping[str, float]]]) -> Mapping[str, float]:
+        if self._prices is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._prices
+        task = self._inflight
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._refresh(fetch))
+            self._inflight = task
+        # shielded so a cancelled caller does not cancel the fetch other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _refresh(self, fetch: Callable[[], Awaitable[Mapping[str, float]]]) -> Mapping[str, float]:
+        prices = await fetch()
+        self._prices, self._fetched_at = prices, time.monotonic()
+        logger.debug(f"Price cache refreshed with {len(prices)} assets")
+        return prices
+
+
+price_cache = PriceCache()
+
+
+def _shared_connector() -> aiohttp.TCPConnector:
+    """Connection pool of the running event loop, shared by every tracker's HTTP session."""
+    loop = asyncio.get_running_loop()
+    connector = _connectors.get(loop)
+    if connector is None or connector.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        _connectors[loop] = connector
+    return connector
+
+
+async def close_http_pool():
+    """Close the running event loop's shared connection pool, e.g. before the loop itself is closed."""
+    connector = _connectors.pop(asyncio.get_running_loop(), None)
+    if connector is not None:
+        await connector.close()
+
+
+def usdt_prices(tickers: Iterable[Tuple[str, float]]) -> Mapping[str, float]:
+    """Derive the USDT price of every asset from (symbol, price) pairs, via BTC when there is no USDT pair."""
+    # Create price lookup dictionary for both USDT and BTC pairs
+    prices = {}
+    btc_prices = {}
+    btc_usdt_price = None
+
+    for symbol, price in tickers:
+        if symbol.endswith('USDT'):
+            base = symbol[:-4]  # Remove 'USDT'
+            prices[base] = price
+        elif symbol.endswith('BTC'):
+            base = symbol[:-3]  # Remove 'BTC'
+            btc_prices[base] = price
+        if symbol == 'BTCUSDT':
+            btc_usdt_price = price
+
+    # For tokens without USDT pairs, try to calculate via BTC
+    if btc_usdt_price:
+        for base, btc_price in btc_prices.items():
+            if base not in prices:
+                prices[base] = btc_price * btc_usdt_price
+
+    # Add USDT price
+    prices['USDT'] = 1.0
+
+    return MappingProxyType(prices)
+
+
+def spot_breakdown(account: Dict, prices: Mapping[str, float]) -> Dict:
+    total_value = sum(
+        float(asset['free']) * prices.get(asset['asset'], 0) +
+        float(asset['locked']) * prices.get(asset['asset'], 0)
+        for asset in account['balances']
+        if float(asset['free']) + float(asset['locked']) > 0
+    )
+
+    return {
+        'total_value': total_value,
+        'raw_data': account
+    }
+
+
+def futures_breakdown(account: Dict, futures_balances: List[Dict], coin_futures_balances: List[Dict],
+                      prices: Mapping[str, float]) -> Dict:
+    futures_total = sum(float(asset['balance']) for asset in futures_balances)
+    futures_upnl = sum(float(asset['crossUnPnl']) for asset in futures_balances)
+
+    # Convert Coin-M futures balances to USDT
+    coin_futures_total = sum(
+        float(asset['balance']) * prices.get(asset['asset'], 0)
+        for asset in coin_futures_balances
+    )
+    coin_futures_upnl = sum(
+        float(asset['crossUnPnl']) * prices.get(asset['asset'], 0)
+        for asset in coin_futures_balances
+    )
+
+    # Log warnings for missing prices
+    for asset in coin_futures_balances:
+        if asset['asset'] not in prices and (
+                float(asset['balance']) != 0 or float(asset['crossUnPnl']) != 0
+        ):
+            logger.warning(f"No price found for coin-margined futures asset: {asset['asset']}")
+
+    return {
+        'wallet_balance': float(account['totalWalletBalance']) + coin_futures_total,  # add coin futures balance
+        'unrealized_pnl': float(account['totalUnrealizedProfit']) + coin_futures_upnl,  # add coin futures upnl
+        'margin_balance': float(account['totalMarginBalance']),
+        'cross_wallet_balance': float(account['totalCrossWalletBalance']),
+        'cross_upnl': float(account['totalCrossUnPnl']),
+        'available_balance': float(account['availableBalance']),
+        'futures_breakdown': {
+            'total_balance': futures_total,
+            'total_upnl': futures_upnl
+        },
+        'coin_futures_breakdown': {
+            'total_balance': coin_futures_total,
+            'total_upnl': coin_futures_upnl
+        },
+        'raw_data': account
+    }
+
+
+def margin_breakdown(account: Dict, prices: Mapping[str, float]) -> Dict:
+    # Get BTC price for conversion
+    btc_price = prices.get('BTC', 0)
+
+    return {
+        'total_asset_btc': float(account['totalAssetOfBtc']),
+        'total_liability_btc': float(account['totalLiabilityOfBtc']),
+        'total_net_asset_btc': float(account['totalNetAssetOfBtc']),
+        'total_asset_usd': float(account['totalAssetOfBtc']) * btc_price,
+        'total_liability_usd': float(account['totalLiabilityOfBtc']) * btc_price,
+        'total_net_asset_usd': float(account['totalNetAssetOfBtc']) * btc_price,
+        'raw_data': account
+    }
+
+
+def empty_futures_breakdown() -> Dict:
+    return {
+        'wallet_balance': 0,
+        'unrealized_pnl': 0,
+        'margin_balance': 0,
+        'cross_wallet_balance': 0,
+        'cross_upnl': 0,
+        'available_balance': 0,
+        'futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
+        'coin_futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
+        'raw_data': {}
+    }
+
+
+def empty_margin_breakdown() -> Dict:
+    return {
+        'total_asset_btc': 0,
+        'total_liability_btc': 0,
+        'total_net_asset_btc': 0,
+        'total_asset_usd': 0,
+        'total_liability_usd': 0,
+        'total_net_asset_usd': 0,
+        'raw_data': {}
+    }
+
+
+def section_unavailable(error: Exception) -> bool:
+    """Whether `error` says the key has no access to an account section, e.g. futures or margin not enabled."""
+    return isinstance(error, BinanceAPIException) and (
+            error.status_code in (401, 403) or error.code in SECTION_UNAVAILABLE_CODES)
+
+
+def combined_breakdown(spot: Dict, futures: Dict, margin: Dict) -> Dict:
+    total_value = (
+            spot['total_value'] +  # Spot value
+            futures['wallet_balance'] + futures['unrealized_pnl'] +  # Futures value including unrealized PnL
+            margin['total_net_asset_usd']  # Margin net value in USD
+    )
+
+    return {
+        'total_value': total_value,
+        'spot_breakdown': spot,
+        'futures_breakdown': futures,
+        'margin_breakdown': margin
+    }
+
 
 class SimpleAssetTracker:
+    """
+    Binance account breakdowns for one credential.
+
+    Use as `async with SimpleAssetTracker(key, secret) as tracker:` or call `open()`/`close()`. Construction does
+    no I/O; the client's HTTP session is lightweight and runs over the connection pool shared by all trackers.
+    """
+
     def __init__(self, api_key: str, api_secret: str):
         logger.debug("Initializing SimpleAssetTracker")
-        self.client = Client(api_key, api_secret)
-        self.async_client: AsyncClient = None
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.async_client: Optional[AsyncClient] = None
 
-    async def _ensure_async_client(self):
+    async def open(self) -> 'SimpleAssetTracker':
         if self.async_client is None:
-            self.async_client = await AsyncClient.create(
-                api_key=self.client.API_KEY,
-                api_secret=self.client.API_SECRET
+            self.async_client = AsyncClient(
+                api_key=self.api_key,
+                api_secret=self.api_secret,
+                session_params={'connector': _shared_connector(), 'connector_owner': False}
             )
+        return self
 
-    async def _get_all_usdt_prices(self) -> Dict[str, float]:
-        """Get all USDT prices in one API call."""
-        try:
-            tickers = await self.async_client.get_symbol_ticker()
-            # Create price lookup dictionary for both USDT and BTC pairs
-            prices = {}
-            btc_prices = {}
-            btc_usdt_price = None
-
-            for ticker in tickers:
-                symbol = ticker['symbol']
-                price = float(ticker['price'])
-
-                if symbol.endswith('USDT'):
-                    base = symbol[:-4]  # Remove 'USDT'
-                    prices[base] = price
-                elif symbol.endswith('BTC'):
-                    base = symbol[:-3]  # Remove 'BTC'
-                    btc_prices[base] = price
-                if symbol == 'BTCUSDT':
-                    btc_usdt_price = price
-
-            # For tokens without USDT pairs, try to calculate via BTC
-            if btc_usdt_price:
-                for base, btc_price in btc_prices.items():
-                    if base not in prices:
-                        prices[base] = btc_price * btc_usdt_price
-
-            # Add USDT price
-            prices['USDT'] = 1.0
-
-            return prices
-        except Exception as e:
-            logger.error(f"Error fetching prices: {str(e)}\n{format_exc()}")
-            return {'USDT': 1.0}
+    async def close(self):
+        """Release the client's session; pooled connections stay open for other trackers."""
+        if self.async_client is not None:
+            await self.async_client.close_connection()
+            self.async_client = None
 
-    async def get_spot_breakdown(self) -> Dict:
-        """Get spot account breakdown."""
-        try:
-            await self._ensure_async_client()
-            account = await self.async_client.get_account()
-            prices = await self._get_all_usdt_prices()
+    async def __aenter__(self) -> 'SimpleAssetTracker':
+        return await self.open()
 
-            total_value = sum(
-                float(asset['free']) * prices.get(asset['asset'], 0) +
-                float(asset['locked']) * prices.get(asset['asset'], 0)
-                for asset in account['balances']
-                if float(asset['free']) + float(asset['locked']) > 0
-            )
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
 
-            return {
-                'total_value': total_value,
-                'raw_data': account
-            }
-        except Exception as e:
-            logger.error(f"Error fetching spot breakdown: {str(e)}\n{format_exc()}")
-            return {'total_value': 0, 'raw_data': {}}
+    async def _ensure_async_client(self):
+        await self.open()
+
+    async def _fetch_usdt_prices(self) -> Mapping[str, float]:
+        """Download all tickers in one API call and derive the USDT price of every asset."""
+        tickers = await self.async_client.get_symbol_ticker()
+        return usdt_prices((ticker['symbol'], float(ticker['price'])) for ticker in tickers)
+
+    async def _get_all_usdt_prices(self) -> Mapping[str, float]:
+        """Get all USDT prices, shared with every other tracker through the process-wide price cache."""
+        return await price_cache.get(self._fetch_usdt_prices)
+
+    async def _prices_or_fetch(self, prices: Dict[str, float] = None) -> Dict[str, float]:
+        return prices if prices is not None else await self._get_all_usdt_prices()
 
-    async def get_futures_breakdown(self) -> Dict:
-        """Get futures account breakdown."""
+    async def get_spot_breakdown(self, prices: Dict[str, float] = None) -> Dict:
+        """Get spot account breakdown, valued with `prices` when given. Errors propagate, spot access is required."""
+        await self._ensure_async_client()
+        account, prices = await asyncio.gather(self.async_client.get_account(), self._prices_or_fetch(prices))
+        return spot_breakdown(account, prices)
+
+    async def get_futures_breakdown(self, prices: Dict[str, float] = None) -> Dict:
+        """Get futures account breakdown, valued with `prices` when given, empty if the key has no futures access."""
+        await self._ensure_async_client()
         try:
-            await self._ensure_async_client()
-            account = await self.async_client.futures_account()
-            prices = await self._get_all_usdt_prices()
-
-            # Get USDT-M futures balances
-            futures_balances = await self.async_client.futures_account_balance()
-            futures_total = sum(float(asset['balance']) for asset in futures_balances)
-            futures_upnl = sum(float(asset['crossUnPnl']) for asset in futures_balances)
-
-            # Get Coin-M futures balances and convert to USDT
-            coin_futures_balances = await self.async_client.futures_coin_account_balance()
-            coin_futures_total = sum(
-                float(asset['balance']) * prices.get(asset['asset'], 0)
-                for asset in coin_futures_balances
-            )
-            coin_futures_upnl = sum(
-                float(asset['crossUnPnl']) * prices.get(asset['asset'], 0)
-                for asset in coin_futures_balances
+            account, futures_balances, coin_futures_balances, prices = await asyncio.gather(
+                self.async_client.futures_account(),
+                self.async_client.futures_account_balance(),  # USDT-M futures balances
+                self.async_client.futures_coin_account_balance(),  # Coin-M futures balances
+                self._prices_or_fetch(prices)
             )
-
-            # Log warnings for missing prices
-            for asset in coin_futures_balances:
-                if asset['asset'] not in prices and (
-                        float(asset['balance']) != 0 or float(asset['crossUnPnl']) != 0
-                ):
-                    logger.warning(f"No price found for coin-margined futures asset: {asset['asset']}")
-
-            return {
-                'wallet_balance': float(account['totalWalletBalance']) + coin_futures_total,  # add coin futures balance
-                'unrealized_pnl': float(account['totalUnrealizedProfit']) + coin_futures_upnl,  # add coin futures upnl
-                'margin_balance': float(account['totalMarginBalance']),
-                'cross_wallet_balance': float(account['totalCrossWalletBalance']),
-                'cross_upnl': float(account['totalCrossUnPnl']),
-                'available_balance': float(account['availableBalance']),
-                'futures_breakdown': {
-                    'total_balance': futures_total,
-                    'total_upnl': futures_upnl
-                },
-                'coin_futures_breakdown': {
-                    'total_balance': coin_futures_total,
-                    'total_upnl': coin_futures_upnl
-                },
-                'raw_data': account
-            }
         except Exception as e:
-            logger.error(f"Error fetching futures breakdown: {str(e)}\n{format_exc()}")
-            return {
-                'wallet_balance': 0,
-                'unrealized_pnl': 0,
-                'margin_balance': 0,
-                'cross_wallet_balance': 0,
-                'cross_upnl': 0,
-                'available_balance': 0,
-                'futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
-                'coin_futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
-                'raw_data': {}
-            }
-
-    async def get_margin_breakdown(self) -> Dict:
-        """Get margin account breakdown."""
+            if not section_unavailable(e):
+                raise
+            logger.info(f"futures account not available for this key, reporting it empty: {str(e)}")
+            return empty_futures_breakdown()
+        return futures_breakdown(account, futures_balances, coin_futures_balances, prices)
+
+    async def get_margin_breakdown(self, prices: Dict[str, float] = None) -> Dict:
+        """Get margin account breakdown, valued with `prices` when given, empty if the key has no margin account."""
+        await self._ensure_async_client()
         try:
-            await self._ensure_async_client()
-            account = await self.async_client.get_margin_account()
-
-            # Get BTC price for conversion
-            prices = await self._get_all_usdt_prices()
-            btc_price = prices.get('BTC', 0)
-
-            return {
-                'total_asset_btc': float(account['totalAssetOfBtc']),
-                'total_liability_btc': float(account['totalLiabilityOfBtc']),
-                'total_net_asset_btc': float(account['totalNetAssetOfBtc']),
-                'total_asset_usd': float(account['totalAssetOfBtc']) * btc_price,
-                'total_liability_usd': float(account['totalLiabilityOfBtc']) * btc_price,
-                'total_net_asset_usd': float(account['totalNetAssetOfBtc']) * btc_price,
-                'raw_data': account
-            }
+            account, prices = await asyncio.gather(self.async_client.get_margin_account(),
+                                                   self._prices_or_fetch(prices))
         except Exception as e:
-            logger.error(f"Error fetching margin breakdown: {str(e)}\n{format_exc()}")
-            return {
-                'total_asset_btc': 0,
-                'total_liability_btc': 0,
-                'total_net_asset_btc': 0,
-                'total_asset_usd': 0,
-                'total_liability_usd': 0,
-                'total_net_asset_usd': 0,
-                'raw_data': {}
-            }
+            if not section_unavailable(e):
+                raise
+            logger.info(f"margin account not available for this key, reporting it empty: {str(e)}")
+            return empty_margin_breakdown()
+        return margin_breakdown(account, prices)
 
     async def get_all_breakdowns(self) -> Dict:
-        """Get all account breakdowns."""
+        """
+        Get all account breakdowns. A failed request (bad key, rate limit, network) raises rather than reading as
+        a zero balance.
+        """
+        await self._ensure_async_client()
+
+        # One price snapshot shared by all breakdowns, which then run concurrently
+        prices = await self._get_all_usdt_prices()
+        spot, futures, margin = await asyncio.gather(
+            self.get_spot_breakdown(prices),
+            self.get_futures_breakdown(prices),
+            self.get_margin_breakdown(prices)
+        )
+
+        return combined_breakdown(spot, futures, margin)
+
+
+class TickerPriceStream:
+    """
+    USDT prices kept current by the all-market mini ticker stream, shared by the streaming trackers of the event
+    loop that first acquires it.
+
+    The stream only carries symbols that changed in the last second, so every symbol is seeded from one REST call
+    each time the socket (re)connects. `prices()` returns None once the stream has been quiet for
+    STREAM_STALE_AFTER seconds, and callers fall back to REST prices.
+    """
+
+    def __init__(self):
+        self._closes: Dict[str, float] = {}
+        self._prices: Optional[Mapping[str, float]] = None
+        self._received_at = 0.0
+        self._client: Optional[AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._users = 0
+
+    async def acquire(self):
+        self._users += 1
+        if self._task is None:
+            self._client = AsyncClient(session_params={'connector': _shared_connector(), 'connector_owner': False})
+            self._task = asyncio.create_task(self._follow())
+
+    async def release(self):
+        self._users -= 1
+        if self._users == 0 and self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            await self._client.close_connection()
+            self._task, self._client, self._received_at = None, None, 0.0
+
+    def prices(self) -> Optional[Mapping[str, float]]:
+        if time.monotonic() - self._received_at > STREAM_STALE_AFTER:
+            return None
+        if self._prices is None:
+            self._prices = usdt_prices(self._closes.items())
+        return self._prices
+
+    async def _follow(self):
+        sockets = BinanceSocketManager(self._client)
+        backoff = 1
+        while True:
+            try:
+                async with sockets.miniticker_socket() as stream:
+                    tickers = await self._client.get_symbol_ticker()
+                    self._closes = {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+                    self._prices, self._received_at = None, time.monotonic()
+                    backoff = 1
+                    while True:
+                        msg = await stream.recv()
+                        if isinstance(msg, dict):
+                            raise ConnectionError(msg.get('m', msg))
+                        for ticker in msg:
+                            self._closes[ticker['s']] = float(ticker['c'])
+                        self._prices, self._received_at = None, time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Ticker stream dropped, reconnecting in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+ticker_stream = TickerPriceStream()
+
+
+class StreamingAssetTracker(SimpleAssetTracker):
+    """
+    SimpleAssetTracker kept current by websocket streams instead of REST polling, reads are local.
+
+    Each of the spot, USDT-M futures and margin user-data streams is connected first and its section is then
+    snapshotted over REST, so no event falls between the two. Spot balance deltas are applied in place. Futures
+    and margin events only carry part of what the breakdowns show, so they trigger a debounced REST resync of
+    their section instead. A section is also resynced after its stream reconnects (events may have been missed),
+    every STREAM_RESYNC_INTERVAL seconds, and for futures with open positions, whose PnL moves with the mark price,
+    every STREAM_POSITION_REFRESH seconds. The socket manager keeps the listen keys alive.
+
+    A futures or margin section the key has no access to is reported empty, as in REST mode, and stops being
+    followed; spot access is required.
+    """
+
+    SECTIONS = ('spot', 'futures', 'margin')
+    RESYNC_EVENTS = {
+        'futures': {'ACCOUNT_UPDATE'},
+        'margin': {'outboundAccountPosition', 'balanceUpdate'}
+    }
+
+    def __init__(self, api_key: str, api_secret: str):
+        super().__init__(api_key, api_secret)
+        self._spot_balances: Dict[str, Tuple[float, float]] = {}
+        self._spot_event_times: Dict[str, int] = {}
+        self._futures_raw: Optional[Tuple[Dict, List[Dict], List[Dict]]] = None
+        self._margin_raw: Optional[Dict] = None
+        self._synced = {section: asyncio.Event() for section in self.SECTIONS}
+        self._synced_at = {section: 0.0 for section in self.SECTIONS}
+        self._dirty = {section: False for section in self.SECTIONS}
+        self._resyncs: Dict[str, asyncio.Task] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._unavailable: Set[str] = set()
+        self._start_error: Optional[Exception] = None
+        self.last_read = time.monotonic()
+
+    async def start(self, timeout: float = STREAM_START_TIMEOUT) -> 'StreamingAssetTracker':
+        """Connect the streams and wait until every section holds its first snapshot."""
+        await self.open()
+        await ticker_stream.acquire()
+        sockets = BinanceSocketManager(self.async_client)
+        self._tasks = [
+            asyncio.create_task(self._follow('spot', sockets.user_socket)),
+            asyncio.create_task(self._follow('futures', sockets.futures_user_socket)),
+            asyncio.create_task(self._follow('margin', sockets.margin_socket)),
+            asyncio.create_task(self._resync_periodically())
+        ]
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in self._synced.values())), timeout)
+        if self._start_error is not None:
+            raise self._start_error
+        return self
+
+    async def stop(self):
+        tasks = self._tasks + list(self._resyncs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._tasks:
+            self._tasks = []
+            await ticker_stream.release()
+        await self.close()
+
+    async def _follow(self, section: str, open_socket: Callable):
+        backoff = 1
+        while True:
+            try:
+                async with open_socket() as stream:
+                    await self._resync(section)
+                    backoff = 1
+                    while True:
+                        msg = await stream.recv()
+                        if msg.get('e') in ('error', 'listenKeyExpired'):
+                            raise ConnectionError(msg.get('m', msg['e']))
+                        self._on_event(section, msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if section_unavailable(e):
+                    self._mark_unavailable(section, e)
+                    return
+                logger.warning(f"{section} user stream dropped, reconnecting in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _mark_unavailable(self, section: str, error: Exception):
+        if section == 'spot':
+            self._start_error = error
+        else:
+            logger.info(f"{section} account not available for this key, reporting it empty: {str(error)}")
+            self._unavailable.add(section)
+        self._synced[section].set()
+
+    def _on_event(self, section: str, msg: Dict):
+        if section == 'spot':
+            if msg.get('e') == 'outboundAccountPosition':
+                for balance in msg['B']:
+                    self._spot_balances[balance['a']] = (float(balance['f']), float(balance['l']))
+                    self._spot_event_times[balance['a']] = msg['u']
+        elif msg.get('e') in self.RESYNC_EVENTS[section]:
+            self._schedule_resync(section)
+
+    def _schedule_resync(self, section: str):
+        self._dirty[section] = True
+        task = self._resyncs.get(section)
+        if task is None or task.done():
+            self._resyncs[section] = asyncio.create_task(self._resync_when_dirty(section))
+
+    async def _resync_when_dirty(self, section: str):
+        # a burst of events, e.g. one per fill, costs a single resync
+        while self._dirty[section]:
+            await asyncio.sleep(STREAM_RESYNC_DEBOUNCE)
+            try:
+                await self._resync(section)
+            except Exception as e:
+                logger.error(f"Error resyncing {section} account: {str(e)}")
+                return
+
+    async def _resync(self, section: str):
+        self._dirty[section] = False
+        if section == 'spot':
+            account = await self.async_client.get_account()
+            balances = {asset['asset']: (float(asset['free']), float(asset['locked']))
+                        for asset in account['balances']}
+            # keep balances whose stream update is newer than the snapshot
+            for asset, event_time in self._spot_event_times.items():
+                if event_time > account['updateTime'] and asset in self._spot_balances:
+                    balances[asset] = self._spot_balances[asset]
+            self._spot_balances = balances
+        elif section == 'futures':
+            self._futures_raw = tuple(await asyncio.gather(
+                self.async_client.futures_account(),
+                self.async_client.futures_account_balance(),
+                self.async_client.futures_coin_account_balance()
+            ))
+        else:
+            self._margin_raw = await self.async_client.get_margin_account()
+        self._synced_at[section] = time.monotonic()
+        self._synced[section].set()
+
+    def _has_open_positions(self) -> bool:
+        account, _, coin_futures_balances = self._futures_raw
+        return (any(float(position['positionAmt']) != 0 for position in account.get('positions', []))
+                or any(float(asset['crossUnPnl']) != 0 for asset in coin_futures_balances))
+
+    async def _resync_periodically(self):
+        while True:
+            await asyncio.sleep(STREAM_POSITION_REFRESH)
+            now = time.monotonic()
+            for section in set(self.SECTIONS) - self._unavailable:
+                if now - self._synced_at[section] > STREAM_RESYNC_INTERVAL or (
+                        section == 'futures' and self._futures_raw is not None and self._has_open_positions()):
+                    self._schedule_resync(section)
+
+    async def _get_all_usdt_prices(self) -> Mapping[str, float]:
+        prices = ticker_stream.prices()
+        return prices if prices is not None else await super()._get_all_usdt_prices()
+
+    async def get_all_breakdowns(self) -> Dict:
+        """Get all account breakdowns from the streamed state, no account request is made."""
+        self.last_read = time.monotonic()
+        prices = await self._get_all_usdt_prices()
+        spot_account = {'balances': [{'asset': asset, 'free': free, 'locked': locked}
+                                     for asset, (free, locked) in self._spot_balances.items()]}
+        return combined_breakdown(
+            spot_breakdown(spot_account, prices),
+            (empty_futures_breakdown() if 'futures' in self._unavailable
+             else futures_breakdown(*self._futures_raw, prices)),
+            empty_margin_breakdown() if 'margin' in self._unavailable else margin_breakdown(self._margin_raw, prices)
+        )
+
+
+class StreamingTrackerPool:
+    """Running streaming trackers keyed by API key, stopped after `idle_ttl` seconds without a read."""
+
+    def __init__(self, idle_ttl: float = STREAM_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._trackers: Dict[str, StreamingAssetTracker] = {}
+        self._starting: Dict[str, asyncio.Task] = {}
+
+    async def get(self, api_key: str, api_secret: str) -> StreamingAssetTracker:
+        await self.evict_idle()
+        tracker = self._trackers.get(api_key)
+        if tracker is not None and tracker.api_secret != api_secret:
+            await self._trackers.pop(api_key).stop()
+            tracker = None
+        if tracker is not None:
+            return tracker
+        task = self._starting.get(api_key)
+        if task is None:
+            task = asyncio.create_task(self._start(api_key, api_secret))
+            self._starting[api_key] = task
+        # shielded so a caller's timeout does not abort a start other callers wait on
+        return await asyncio.shield(task)
+
+    async def _start(self, api_key: str, api_secret: str) -> StreamingAssetTracker:
+        tracker = StreamingAssetTracker(api_key, api_secret)
         try:
-            await self._ensure_async_client()
+            await tracker.start()
+            self._trackers[api_key] = tracker
+            return tracker
+        except BaseException:
+            await tracker.stop()
+            raise
+        finally:
+            del self._starting[api_key]
 
-            spot = await self.get_spot_breakdown()
-            futures = await self.get_futures_breakdown()
-            margin = await self.get_margin_breakdown()
+    async def evict_idle(self):
+        now = time.monotonic()
+        for api_key in [key for key, tracker in self._trackers.items() if now - tracker.last_read > self.idle_ttl]:
+            logger.info("Stopping idle streaming tracker")
+            await self._trackers.pop(api_key).stop()
 
-            total_value = (
-                    spot['total_value'] +  # Spot value
-                    futures['wallet_balance'] + futures['unrealized_pnl'] +  # Futures value including unrealized PnL
-                    margin['total_net_asset_usd']  # Margin net value in USD
-            )
+    async def close(self):
+        trackers, self._trackers = list(self._trackers.values()), {}
+        await asyncio.gather(*(tracker.stop() for tracker in trackers), return_exceptions=True)
 
-            return {
-                'total_value': total_value,
-                'spot_breakdown': spot,
-                'futures_breakdown': futures,
-                'margin_breakdown': margin
-            }
-        except Exception as e:
-            logger.error(f"Error fetching all breakdowns: {str(e)}\n{format_exc()}")
-            return {
-                'total_value': 0,
-                'spot_breakdown': {'total_value': 0, 'raw_data': {}},
-                'futures_breakdown': {
-                    'wallet_balance': 0,
-                    'unrealized_pnl': 0,
-                    'margin_balance': 0,
-                    'cross_wallet_balance': 0,
-                    'cross_upnl': 0,
-                    'available_balance': 0,
-                    'futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
-                    'coin_futures_breakdown': {'total_balance': 0, 'total_upnl': 0},
-                    'raw_data': {}
-                },
-                'margin_breakdown': {
-                    'total_asset_btc': 0,
-                    'total_liability_btc': 0,
-                    'total_net_asset_btc': 0,
-                    'total_asset_usd': 0,
-                    'total_liability_usd': 0,
-                    'total_net_asset_usd': 0,
-                    'raw_data': {}
-                }
-            }
+
+streaming_trackers = StreamingTrackerPool()
@@ -1,15 +1,28 @@
 import asyncio
+import atexit
+import concurrent.futures
+import os
+import time
 from traceback import format_exc
 
 import streamlit as st
 from loguru import logger
 
-from database import CredentialManager, UserManager, init_db
-from simple_asset_tracker import SimpleAssetTracker
+from background_loop import BackgroundLoop
+from dashboard_cache import DashboardCache, failed_credential_data
+from database import CredentialManager, SessionManager, UserManager, init_db
+from simple_asset_tracker import SimpleAssetTracker, close_http_pool, streaming_trackers
 
 # Configure logger
 logger.add("app.log", rotation="500 MB", retention="10 days")
 
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 5))  # credentials fetched at the same time
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', 30))  # seconds allowed per credential
+DASHBOARD_FETCH_TIMEOUT = float(os.getenv('DASHBOARD_FETCH_TIMEOUT', 120))  # seconds allowed for a whole sweep
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', 300))  # seconds before rows refresh in the background
+# follow balances and prices over websockets instead of polling REST on every refresh
+STREAMING_TRACKERS = os.getenv('STREAMING_TRACKERS', 'false').lower() in ('1', 'true', 'yes')
+
 # Initialize session state
 if 'user' not in st.session_state:
     st.session_state.user = None
@@ -21,15 +34,34 @@ def login_user(username: str, password: str) -> bool:
     if user:
         logger.info(f"Login successful for user: {username}")
         st.session_state.user = user
+        # kept in the URL so a page reload resumes the session without re-checking the password. The URL can leak
+        # (history, screenshots, shared links), so the token is short-lived and replaced whenever it is used
+        st.query_params['session'] = SessionManager.create_session(user['id'])
         return True
     logger.warning(f"Failed login attempt for user: {username}")
     return False
 
 
 def logout_user():
+    token = st.query_params.get('session')
+    if token:
+        SessionManager.revoke_session(token)
+        del st.query_params['session']
     st.session_state.user = None
 
 
+def restore_session():
+    """Log the visitor back in from the session token in the URL and replace it, so an older copy stops working."""
+    token = st.query_params.get('session')
+    if st.session_state.user or not token:
+        return
+    session = SessionManager.rotate_session(token)
+    if session is None:
+        del st.query_params['session']
+        return
+    st.session_state.user, st.query_params['session'] = session
+
+
 def register_user(username: str, password: str) -> bool:
     logger.info(f"Registration attempt for username: {username}")
     success = UserManager.create_user(username, password)
@@ -133,36 +165,95 @@ def render_credential_section():
                         st.error("删除API失败")
 
 
-async def fetch_asset_data(credentials):
-    logger.info("Starting to fetch asset data")
-    all_data = []
-    for cred in credentials:
-        logger.debug(f"Fetching data for credential: {cred['label']}")
-        tracker = SimpleAssetTracker(cred['api_key'], cred['api_secret'])
-        try:
+async def fetch_credential_data(cred) -> dict:
+    logger.debug(f"Fetching data for credential: {cred['label']}")
+    if STREAMING_TRACKERS:
+        tracker = await streaming_trackers.get(cred['api_key'], cred['api_secret'])
+        data = await tracker.get_all_breakdowns()
+    else:
+        async with SimpleAssetTracker(cred['api_key'], cred['api_secret']) as tracker:
             data = await tracker.get_all_breakdowns()
 
-            initial_value = float(cred['initial_value_usd'])
-            pnl = data['total_value'] - initial_value
-            pnl_percentage = (pnl / initial_value) * 100 if initial_value > 0 else 0
-
-            all_data.append({
-                'label': cred['label'],
-                'total_value': data['total_value'],
-                'spot': data['spot_breakdown'],
-                'futures': data['futures_breakdown'],
-                'margin': data['margin_breakdown'],
-                'initial_value': initial_value,
-                'pnl': pnl,
-                'pnl_percentage': pnl_percentage
-            })
-        except Exception as e:
-            logger.error(f"Error fetching data for {cred['label']}: {str(e)} {format_exc()}")
-            st.error(f"Error fetching data for {cred['label']}: {str(e)}")
+    initial_value = float(cred['initial_value_usd'])
+    pnl = data['total_value'] - initial_value
+    pnl_percentage = (pnl / initial_value) * 100 if initial_value > 0 else 0
+
+    return {
+        'label': cred['label'],
+        'status': 'ok',
+        'total_value': data['total_value'],
+        'spot': data['spot_breakdown'],
+        'futures': data['futures_breakdown'],
+        'margin': data['margin_breakdown'],
+        'initial_value': initial_value,
+        'pnl': pnl,
+        'pnl_percentage': pnl_percentage
+    }
+
+
+async def fetch_asset_data(credentials, concurrency: int = FETCH_CONCURRENCY, timeout: float = FETCH_TIMEOUT):
+    """
+    Fetch every credential concurrently, at most `concurrency` at a time and `timeout` seconds each.
+
+    Results keep the order of `credentials`; a failed or timed-out credential yields a row whose status says so.
+    """
+    logger.info("Starting to fetch asset data")
+    limit = asyncio.Semaphore(concurrency)
+
+    async def fetch(cred):
+        async with limit:
+            try:
+                return await asyncio.wait_for(fetch_credential_data(cred), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out fetching data for {cred['label']} after {timeout}s")
+                return failed_credential_data(cred, 'timeout', f"{timeout}s 内未返回")
+            except Exception as e:
+                logger.error(f"Error fetching data for {cred['label']}: {str(e)} {format_exc()}")
+                return failed_credential_data(cred, 'error', str(e))
+
+    all_data = list(await asyncio.gather(*(fetch(cred) for cred in credentials)))
     logger.info("Completed fetching asset data")
     return all_data
 
 
+def format_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)}秒"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}分钟"
+    return f"{int(seconds // 3600)}小时"
+
+
+async def shutdown_background_work():
+    await streaming_trackers.close()
+    await close_http_pool()
+
+
+@st.cache_resource
+def get_background_loop() -> BackgroundLoop:
+    """Event loop owning the async trackers' connection pool, kept for the life of the app process."""
+    background_loop = BackgroundLoop(name='dashboard-loop')
+    atexit.register(lambda: background_loop.stop(shutdown_background_work()))
+    return background_loop
+
+
+def fetch_dashboard_rows(credentials):
+    """Blocking entry point for synchronous callers: one sweep on the background loop."""
+    try:
+        return get_background_loop().run(fetch_asset_data(credentials), DASHBOARD_FETCH_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        logger.error(f"Dashboard sweep of {len(credentials)} credentials timed out after {DASHBOARD_FETCH_TIMEOUT}s")
+        return [failed_credential_data(cred, 'timeout', f"{DASHBOARD_FETCH_TIMEOUT}s 内未返回")
+                for cred in credentials]
+
+
+@st.cache_resource
+def get_dashboard_cache() -> DashboardCache:
+    """One cache for the whole app process, shared by every user's session."""
+    return DashboardCache(
+        fetch=fetch_dashboard_rows, ttl=DASHBOARD_CACHE_TTL)
+
+
 def render_dashboard():
     st.subheader("资产仪表盘")
 
@@ -171,27 +262,26 @@ def render_dashboard():
         st.info("未找到API。请在API管理部分添加API。")
         return
 
+    dashboard_cache = get_dashboard_cache()
+
     # Add refresh button in the header
     col1, col2 = st.columns([0.9, 0.1])
     with col1:
         st.write("### 总览")
     with col2:
         if st.button("🔄 刷新"):
-            st.cache_data.clear()
+            dashboard_cache.invalidate(st.session_state.user['id'])
             st.rerun()
 
-    @st.cache_data(ttl=300)  # Cache data for 5 minutes
-    def get_cached_data(credentials_str):
-        return asyncio.run(fetch_asset_data(credentials))
-
-    # Use credentials as cache key
-    credentials_str = str([(c['id'], c['label']) for c in credentials])
-    data = get_cached_data(credentials_str)
+    cached = dashboard_cache.get(st.session_state.user['id'], credentials)
+    data = [d for d, _ in cached]
+    ages = [time.time() - fetched_at for _, fetched_at in cached]
 
-    # Summary section
-    total_value = sum(d['total_value'] for d in data)
-    total_initial = sum(d['initial_value'] for d in data)
-    total_pnl = sum(d['pnl'] for d in data)
+    # Summary section, failed credentials are left out
+    fetched = [d for d in data if 'total_value' in d]
+    total_value = sum(d['total_value'] for d in fetched)
+    total_initial = sum(d['initial_value'] for d in fetched)
+    total_pnl = sum(d['pnl'] for d in fetched)
     total_pnl_percentage = (total_pnl / total_initial) * 100 if total_initial > 0 else 0
 
     col1, col2, col3, col4 = st.columns(4)
@@ -199,11 +289,20 @@ def render_dashboard():
     col2.metric("初始投资", f"${total_initial:,.2f}")
     col3.metric("总盈亏", f"${total_pnl:,.2f}")
     col4.metric("总盈亏率", f"{total_pnl_percentage:.2f}%")
+    st.caption(f"数据更新于 {format_age(max(ages))}前")
+    if len(fetched) < len(data):
+        st.warning(f"{len(data) - len(fetched)} 个API获取失败，未计入总览")
 
     # Individual credential sections
     st.write("### 账户详情")
-    for d in data:
-        with st.expander(f"{d['label']}"):
+    for d, age in zip(data, ages):
+        if 'total_value' not in d:
+            with st.expander(f"{d['label']} ⚠️"):
+                st.warning(f"数据获取失败 ({d['status']}): {d['error']}")
+            continue
+        with st.expander(f"{d['label']} · {format_age(age)}前更新{' ⚠️' if d['status'] == 'stale' else ''}"):
+            if d['status'] == 'stale':
+                st.warning(f"刷新失败，显示的是旧数据: {d['error']}")
             # Main metrics
             col1, col2 = st.columns(2)
             with col1:
@@ -262,6 +361,7 @@ def main():
 
     # Initialize database
     init_db()
+    restore_session()
 
     # Render logout button if user is logged in
     if st.session_state.user: